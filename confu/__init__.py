@@ -5,41 +5,71 @@ __version__ = '.'.join(__version_info__)
 __maintainer__ = "Marat Dukhan"
 __email__ = "maratek@gmail.com"
 
-import logging
-logger = logging.getLogger("confu")
-logger.setLevel(logging.INFO)
+import sys
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+# The logging module takes most of the time to import confu, so the console output is set up on first use
+_console_configured = False
 
 
-class ConsoleFormatter(logging.Formatter):
-    def __init__(self):
-        super(ConsoleFormatter, self).__init__("%(message)s")
+def setup_console_logging():
+    r"""Sets up console output of the confu logger. Entry points call it, and repeated calls have no effect."""
 
-    def format(self, record):
-        message = super(ConsoleFormatter, self).format(record)
-        if record.levelname in ["DEBUG", "INFO"]:
-            return message[0].upper() + message[1:]
-        else:
-            return {
-                "WARNING": "Warning", "ERROR": "Error", "CRITICAL": "Fatal error"
-            }[record.levelname] + ": " + message[0].lower() + message[1:]
+    global _console_configured
+    if _console_configured:
+        return
+    _console_configured = True
 
-console_formatter = ConsoleFormatter()
-console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
+    import logging
 
+    class ConsoleFormatter(logging.Formatter):
+        def __init__(self):
+            super(ConsoleFormatter, self).__init__("%(message)s")
 
-from confu.builds import Build
-from confu.platform import Platform
+        def format(self, record):
+            message = super(ConsoleFormatter, self).format(record)
+            if record.levelname in ["DEBUG", "INFO"]:
+                return message[0].upper() + message[1:]
+            else:
+                return {
+                    "WARNING": "Warning", "ERROR": "Error", "CRITICAL": "Fatal error"
+                }[record.levelname] + ": " + message[0].lower() + message[1:]
+
+    logger = logging.getLogger("confu")
+    logger.setLevel(logging.INFO)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(ConsoleFormatter())
+    logger.addHandler(console_handler)
+
+
+if sys.version_info >= (3, 7):
+    # Build and Platform are imported on first use, so that importing confu stays cheap
+    def __getattr__(name):
+        if name == "Build":
+            from confu.builds import Build
+            return Build
+        elif name == "Platform":
+            from confu.platform import Platform
+            return Platform
+        elif name == "logger":
+            import logging
+            return logging.getLogger("confu")
+        raise AttributeError("module {module} has no attribute {name}".format(module=__name__, name=name))
+else:
+    import logging
+    logger = logging.getLogger("confu")
+    from confu.builds import Build
+    from confu.platform import Platform
 
 
 def standard_parser(description="Confu configuration script"):
     import argparse
+    setup_console_logging()
 
+    import os
     from os import linesep
-    from confu.platform import host, possible_targets
+    from confu.platform import Platform, host, possible_targets
 
     parser = argparse.ArgumentParser(description=description,
         formatter_class=argparse.RawTextHelpFormatter)
@@ -52,6 +82,66 @@ def standard_parser(description="Confu configuration script"):
         choices=["auto", "gnu", "clang"], default="auto",
         help="toolchain to use for compilation. Potential options:" + linesep +
             linesep.join("    " + name for name in ["auto (default)", "gnu", "clang"]))
+    parser.add_argument("--profile", dest="profile", metavar="PROFILE",
+        choices=["debug", "release", "relwithdebinfo", "custom"],
+        help="build profile with its own flags and build/PROFILE, bin/PROFILE, lib/PROFILE directories." + linesep +
+            "Potential options:" + linesep +
+            linesep.join("    " + name for name in ["debug (no optimization)",
+                                                      "release (optimization, no debug information and assertions)",
+                                                      "relwithdebinfo (optimization with debug information)",
+                                                      "custom (flags from CFLAGS, CXXFLAGS, LDFLAGS)"]) + linesep +
+            "(default: no profile, default flags in build, bin, lib directories)")
+    parser.add_argument("--configure-jobs", dest="configure_jobs", metavar="N", type=int, default=1,
+        help="number of dependencies to configure in parallel worker processes (default: 1)")
+    parser.add_argument("--linker", dest="linker", metavar="LINKER",
+        choices=["default", "bfd", "gold", "lld", "mold"], default="default",
+        help="linker to use instead of the default linker of the compiler. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["default (default)", "bfd", "gold", "lld", "mold"]))
+    parser.add_argument("--fast-link", dest="fast_link", action="store_true",
+        help="reduce the amount of debug information which the linker processes with split DWARF," + linesep +
+            "compressed debug sections, and gdb index")
+    parser.add_argument("--lto", dest="lto", metavar="MODE", choices=["none", "full", "thin"], default="none",
+        help="link-time optimization. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["none (default)", "full", "thin (ThinLTO, requires clang)"]))
+    parser.add_argument("--pgo", dest="pgo", metavar="MODE", choices=["none", "generate", "use"], default="none",
+        help="profile-guided optimization. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["none (default)",
+                                                      "generate (build binaries for training, and pgo target to run them)",
+                                                      "use (optimize with the profile collected by pgo target)"]))
+    parser.add_argument("--pgo-source", dest="pgo_source", metavar="SOURCE",
+        choices=["instrumentation", "sampling"], default="instrumentation",
+        help="source of profiles for profile-guided optimization. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["instrumentation (default)",
+                                                      "sampling (AutoFDO profiles from perf record)"]))
+    parser.add_argument("--pgo-profile", dest="pgo_profile", metavar="PATH",
+        help="profile to use with --pgo=use instead of the profile collected by pgo target")
+    parser.add_argument("--link-jobs", dest="link_jobs", metavar="N", type=int,
+        help="maximum number of parallel links (default: one per 4 GB of RAM)")
+    parser.add_argument("--heavy-jobs", dest="heavy_jobs", metavar="N", type=int,
+        help="maximum number of parallel compilations of sources marked as heavy" + linesep +
+            "(default: one per 2 GB of RAM)")
+    parser.add_argument("--compiler-launcher", dest="compiler_launcher", metavar="LAUNCHER",
+        default=os.getenv("CONFU_COMPILER_LAUNCHER", "none"),
+        help="program which wraps compilation commands, e.g. ccache or sccache. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["none (default unless set by CONFU_COMPILER_LAUNCHER)",
+                                                      "auto (ccache or sccache, if installed)",
+                                                      "name or path of the launcher executable"]))
+    parser.add_argument("--relocatable", dest="relocatable", action="store_true",
+        help="generate build commands without absolute paths to the project, so that" + linesep +
+            "compiler caches can share objects between checkouts in different directories")
+    parser.add_argument("--unity", dest="unity", metavar="N", type=int, nargs="?", const=16, default=0,
+        help="compile C and C++ sources of each library and executable in batches of N (default: 16)" + linesep +
+            "sources combined into unity translation units")
+    parser.add_argument("--cxx-modules", dest="cxx_modules", metavar="MODE",
+        choices=["none", "named", "clang"], default="none",
+        help="support for C++ modules. Potential options:" + linesep +
+            linesep.join("    " + name for name in ["none (default)",
+                                                      "named (C++20 named modules, requires gcc 14+ or clang-scan-deps)",
+                                                      "clang (Clang header modules with a module cache)"]))
+    parser.add_argument("--object-cache", dest="object_cache", action="store_true",
+        default=os.getenv("CONFU_OBJECT_CACHE", "").lower() in ["1", "yes", "on", "true"],
+        help="cache compiled objects and static libraries in the user-level object cache" + linesep +
+            "(default if CONFU_OBJECT_CACHE=1)")
 
     
 
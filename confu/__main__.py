@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import argparse
 import logging
 
@@ -29,63 +30,289 @@ def setup_deps(options, unparsed_args):
         dep_name = with_arg[len("--with-"):]
         dependency_paths[dep_name] = path
 
-    def setup_project_deps(project_dir, root_dir, namespace=""):
+    def setup_dependency(dep, project_dir, deps_dir, qualified_name):
+        import confu.git
+        dep_dir = os.path.join(deps_dir, dep.name)
+        is_git_dep = dep.url is not None and dep.name not in dependency_paths
+        locked = lock.deps.get(dep.name) if is_git_dep and lock.is_current(dep) else None
+        reused = False
+        if os.path.exists(dep_dir):
+            if is_git_dep and locked is None and options.update and not os.path.islink(dep_dir):
+                logger.info("update dependency {name} from {url}".format(
+                    name=qualified_name, url=dep.url))
+                confu.git.fetch(dep.url, dep_dir, ref=dep.ref, depth=dep.depth)
+            else:
+                logger.info("reuse dependency {name} from {path}".format(
+                    name=qualified_name, path=dep_dir))
+                reused = True
+        elif dep.name in dependency_paths:
+            logger.info("link dependency {name} from {path}".format(
+                name=qualified_name, path=dependency_paths[dep.name]))
+            os.symlink(dependency_paths[dep.name], dep_dir)
+        elif dep.url is not None:
+            if locked is not None:
+                logger.info("fetch dependency {name} at locked commit {commit} from {url}".format(
+                    name=qualified_name, commit=locked["commit"], url=dep.url))
+                confu.git.clone(dep.url, dep_dir, ref=locked["commit"], depth=dep.depth, sparse=dep.sparse,
+                    offline=options.frozen)
+            elif options.frozen:
+                raise EnvironmentError("Dependency {name} is not locked in confu.lock: "
+                    "run confu setup without --frozen to update the lockfile".format(name=qualified_name))
+            else:
+                logger.info("fetch dependency {name} from {url}".format(
+                    name=qualified_name, url=dep.url))
+                confu.git.clone(dep.url, dep_dir, ref=dep.ref, depth=dep.depth, sparse=dep.sparse)
+        elif dep.archive is not None:
+            logger.info("extract dependency {name} from {url}".format(
+                name=qualified_name, url=dep.archive))
+            import confu.archive
+            confu.archive.extract(dep.archive, dep.sha256, dep_dir, offline=options.frozen)
+        elif dep.dir is not None:
+            logger.info("link dependency {name} from {path}".format(
+                name=qualified_name, path=os.path.join(project_dir, dep.dir)))
+            os.symlink(os.path.join(project_dir, dep.dir), dep_dir)
+        elif dep.name in builtin_recipes:
+            logger.info("setup dependency {name} using built-in recipe confu.recipes.{name}"
+                .format(name=qualified_name))
+            recipe = confu.recipes.__dict__[dep.name]
+            recipe.setup(dep_dir, offline=options.frozen)
+        else:
+            logger.critical("no source provided for dependency {name} ({qname})"
+                .format(name=dep.name, qname=qualified_name))
+
+        if is_git_dep and not os.path.islink(dep_dir):
+            commit = confu.git.get_commit(dep_dir)
+            if options.frozen:
+                if locked is None or locked["commit"] != commit:
+                    raise EnvironmentError("Dependency {name} at commit {commit} does not match confu.lock"
+                        .format(name=qualified_name, commit=commit))
+            elif reused and locked is None and dep.name in lock.deps:
+                # The existing checkout is kept, and may not match the changed url or ref
+                logger.warning("dependency {name} is locked to a different url or ref than in its manifest: "
+                    "run confu setup --update to update it".format(name=qualified_name))
+            else:
+                lock.deps[dep.name] = {"url": dep.url, "ref": dep.ref, "commit": commit}
+
+        return dep_dir
+
+    def setup_dependency_task(dep, project_dir, deps_dir, qualified_name):
+        try:
+            return dep, qualified_name, setup_dependency(dep, project_dir, deps_dir, qualified_name), None
+        except Exception as e:
+            return dep, qualified_name, None, e
+
+    import os
+    root_dir = os.path.abspath(os.getcwd())
+    deps_dir = os.path.join(root_dir, "deps")
+
+    import confu.manifest
+    lock = confu.manifest.Lock.from_root(root_dir)
+
+    # Dependencies at one level of the manifest tree are set up concurrently, and their own dependencies are
+    # scheduled as soon as they are set up. Each dependency is set up only once, even if listed by several projects.
+    from multiprocessing.pool import ThreadPool
+    from six.moves import queue
+    pool = ThreadPool(max(options.jobs, 1))
+    completed = queue.Queue()
+    scheduled = set()
+    running, finished = 0, 0
+    error = None
+
+    def setup_project_deps(project_dir, namespace=""):
         import confu.manifest
         project = confu.manifest.Project.from_root(project_dir)
 
-        deps_dir = os.path.join(root_dir, "deps")
         if project.deps and not os.path.isdir(deps_dir):
             os.mkdir(deps_dir)
 
+        started = 0
         for dep in project.deps:
-            dep_dir = os.path.join(deps_dir, dep.name)
-            qualified_name = dep.name if not namespace else namespace + ":" + dep.name
-            if os.path.exists(dep_dir):
-                logger.info("reuse dependency {name} from {path}".format(
-                    name=qualified_name, path=dep_dir))
-            elif dep.name in dependency_paths:
-                logger.info("link dependency {name} from {path}".format(
-                    name=qualified_name, path=dependency_paths[dep.name]))
-                os.symlink(dependency_paths[dep.name], dep_dir)
-            elif dep.url is not None:
-                logger.info("fetch dependency {name} from {url}".format(
-                    name=qualified_name, url=dep.url))
-                import confu.git
-                confu.git.clone(dep.url, dep_dir)
-            elif dep.dir is not None:
-                logger.info("link dependency {name} from {path}".format(
-                    name=qualified_name, path=os.path.join(project_dir, dep.dir)))
-                os.symlink(os.path.join(project_dir, dep.dir), dep_dir)
-            elif dep.name in builtin_recipes:
-                logger.info("setup dependency {name} using built-in recipe confu.recipes.{name}"
-                    .format(name=qualified_name))
-                recipe = confu.recipes.__dict__[dep.name]
-                recipe.setup(dep_dir)
+            if dep.name not in scheduled:
+                scheduled.add(dep.name)
+                qualified_name = dep.name if not namespace else namespace + ":" + dep.name
+                pool.apply_async(setup_dependency_task, (dep, project_dir, deps_dir, qualified_name),
+                                 callback=completed.put)
+                started += 1
+        return started
+
+    try:
+        running += setup_project_deps(root_dir)
+        while running != 0:
+            dep, qualified_name, dep_dir, dep_error = completed.get()
+            running -= 1
+            finished += 1
+            if dep_error is not None:
+                logger.critical("failed to set up dependency {name}: {message}".format(
+                    name=qualified_name, message=str(dep_error)))
+                error = error or dep_error
             else:
-                logger.critical("no source provided for dependency {name} ({qname})"
-                    .format(name=dep.name, qname=qualified_name))
+                logger.info("[{finished}/{total}] set up dependency {name}".format(
+                    finished=finished, total=len(scheduled), name=qualified_name))
+                if error is None:
+                    running += setup_project_deps(dep_dir, namespace=qualified_name)
+    finally:
+        pool.close()
+        pool.join()
+
+    if error is not None:
+        raise error
+
+    if lock.deps and not options.frozen:
+        lock.save(root_dir)
+
 
-            setup_project_deps(dep_dir, root_dir,
-                namespace=dep.name if not namespace else namespace + ":" + dep.name)
+def manage_git_cache(options, unparsed_args):
+    import time
+    import confu.git
+    from confu.validators import validate_cache_size
 
+    mirrors = confu.git.list_mirrors()
+    if options.max_size is not None or options.max_age is not None:
+        now = time.time()
+        total_size = sum(size for _, _, size, _ in mirrors)
+        for mirror_dir, url, size, last_used in list(mirrors):
+            expired = options.max_age is not None and now - last_used > options.max_age * 86400
+            oversized = options.max_size is not None and total_size > validate_cache_size(options.max_size)
+            if not expired and not oversized:
+                continue
+
+            logger.info("evict git mirror of {url} ({size:.1f} MB)".format(url=url, size=size / 1048576.0))
+            confu.git.evict_mirror(mirror_dir)
+            mirrors.remove((mirror_dir, url, size, last_used))
+            total_size -= size
+
+    for mirror_dir, url, size, last_used in mirrors:
+        print("{size:10.1f} MB  {time}  {url}".format(size=size / 1048576.0,
+            time=time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)), url=url))
+
+
+def show_cache_stats(options, unparsed_args):
     import os
-    root_dir = os.path.abspath(os.getcwd())
+    import subprocess
+    from confu.validators import validate_compiler_launcher, compiler_launchers
+    if options.launcher is not None:
+        launchers = [validate_compiler_launcher(options.launcher)]
+    else:
+        from confu.utils import find_executable
+        launchers = [find_executable(name) for name in compiler_launchers]
+    launchers = [launcher for launcher in launchers if launcher is not None]
+
+    import confu.cache
+    if os.path.isdir(confu.cache.get_cache_dir()):
+        statistics = confu.cache.get_statistics()
+        lookups = statistics["hits"] + statistics["misses"]
+        print("confu object cache ({path}):".format(path=confu.cache.get_cache_dir()))
+        print("  hits: {hits} ({rate:.1f}%, {remote_hits} from remote cache), misses: {misses}".format(
+            hits=statistics["hits"], remote_hits=statistics["remote_hits"], misses=statistics["misses"],
+            rate=100.0 * statistics["hits"] / lookups if lookups else 0.0))
+        print("  files: {files}, size: {size:.1f} MB (max {max_size:.1f} MB)".format(files=statistics["files"],
+            size=statistics["size"] / 1048576.0, max_size=confu.cache.get_max_size() / 1048576.0))
+    elif not launchers:
+        logger.warning("no compiler launcher found: install one of " + ", ".join(compiler_launchers))
+        return
+
+    for launcher in launchers:
+        print("{launcher}:".format(launcher=os.path.basename(launcher)))
+        returncode = subprocess.call([launcher, "--show-stats"])
+        if returncode != 0:
+            logger.error("failed to get statistics from {launcher}".format(launcher=launcher))
+
+
+def run_cache_server(options, unparsed_args):
+    import confu.cache_server
+    confu.cache_server.main(unparsed_args + options.args)
+
+
+def report_startup_profile(modules=("confu",), count=20):
+    r"""Reports the time to import confu, measured in a fresh interpreter with -X importtime."""
+
+    import os
+    import sys
+    import subprocess
+    if sys.version_info < (3, 7):
+        raise EnvironmentError("--startup-profile requires Python 3.7 or newer")
+
+    import confu
+    env = os.environ.copy()
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(confu.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([package_dir] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    for module in modules:
+        process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import " + module],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        _, report = process.communicate()
+        if process.returncode != 0:
+            raise EnvironmentError("Failed to import {module}:\n{report}".format(module=module, report=report))
+
+        # Nested imports are indented, and precede the import which triggered them. Only the imports of the module
+        # and its dependencies are reported, without the interpreter startup (e.g. site and sitecustomize).
+        imports, subtree = list(), list()
+        total_time = 0
+        for line in report.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                self_time, cumulative_time, name = line[len("import time:"):].split("|")
+                if self_time.strip().isdigit():
+                    name = name[1:].rstrip()
+                    subtree.append((int(self_time), int(cumulative_time), name))
+                    if name == name.lstrip():
+                        # Top-level import
+                        if name == module:
+                            imports += subtree
+                            total_time += int(cumulative_time)
+                        subtree = list()
 
-    setup_project_deps(root_dir, root_dir)
+        print("import {module}: {time:.1f} ms, {imported} modules".format(
+            module=module, time=total_time / 1000.0, imported=len(imports)))
+        print("{self:>10} {cumulative:>12}  module".format(self="self (ms)", cumulative="total (ms)"))
+        for self_time, cumulative_time, name in sorted(imports, reverse=True)[:count]:
+            print("{self:10.2f} {cumulative:12.2f}  {name}".format(
+                self=self_time / 1000.0, cumulative=cumulative_time / 1000.0, name=name))
 
 
 parser = argparse.ArgumentParser(
     description="Confu: cross-platform C/C++ configuration system")
+parser.add_argument("--startup-profile", dest="startup_profile", action="store_true",
+    help="report modules which take the most time to import when confu is imported")
 subparsers = parser.add_subparsers(title="commands",
                                    description="supported commands")
 setup_parser = subparsers.add_parser("setup", help="set up dependencies")
+setup_parser.add_argument("-j", "--jobs", dest="jobs", metavar="N", type=int, default=1,
+    help="number of dependencies to fetch concurrently (default: 1)")
+lock_group = setup_parser.add_mutually_exclusive_group()
+lock_group.add_argument("--frozen", dest="frozen", action="store_true",
+    help="set up dependencies at commits from confu.lock without network access, and verify existing ones")
+lock_group.add_argument("--update", dest="update", action="store_true",
+    help="fetch existing dependencies whose url or ref changed since confu.lock was written")
 setup_parser.add_argument("args", nargs=argparse.REMAINDER)
 setup_parser.set_defaults(process=setup_deps)
+git_cache_parser = subparsers.add_parser("git-cache",
+    help="list or evict least recently used mirrors in the shared git cache")
+git_cache_parser.add_argument("--max-size", dest="max_size", metavar="SIZE",
+    help="evict least recently used mirrors until the cache is at most SIZE (e.g. 10G)")
+git_cache_parser.add_argument("--max-age", dest="max_age", metavar="DAYS", type=float,
+    help="evict mirrors not used in the last DAYS days")
+git_cache_parser.set_defaults(process=manage_git_cache)
+cache_stats_parser = subparsers.add_parser("cache-stats",
+    help="show hit rates of the confu object cache and compiler launchers (ccache, sccache)")
+cache_stats_parser.add_argument("--launcher", dest="launcher", metavar="LAUNCHER",
+    default=os.getenv("CONFU_COMPILER_LAUNCHER"),
+    help="compiler launcher to query (default: all installed launchers)")
+cache_stats_parser.set_defaults(process=show_cache_stats)
+cache_server_parser = subparsers.add_parser("cache-server", add_help=False,
+    help="run a remote object cache server for builds with CONFU_REMOTE_CACHE=http://<host>:<port>")
+cache_server_parser.add_argument("args", nargs=argparse.REMAINDER)
+cache_server_parser.set_defaults(process=run_cache_server)
 
 
 def main():
+    import confu
+    confu.setup_console_logging()
     options, unparsed_args = parser.parse_known_args()
-    options.process(options, unparsed_args)
+    if options.startup_profile:
+        report_startup_profile()
+    elif hasattr(options, "process"):
+        options.process(options, unparsed_args)
+    else:
+        parser.print_usage()
 
 
 if __name__ == "__main__":
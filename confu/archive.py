@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+
+import os
+import logging
+
+
+logger = logging.getLogger("confu")
+
+
+# Size of chunks in which archives are downloaded and hashed
+chunk_size = 1024 * 1024
+
+
+class _HashingReader:
+    def __init__(self, stream):
+        import hashlib
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+    def drain(self):
+        while self.read(chunk_size):
+            pass
+        return self.hash.hexdigest()
+
+
+def get_extract_dir(sha256):
+    from confu.utils import get_cache_dir
+    return get_cache_dir("archives", sha256.lower())
+
+
+def _is_zip(url):
+    from six.moves.urllib.parse import urlparse
+    return urlparse(url).path.lower().endswith(".zip")
+
+
+def _check_member_path(name, archive_url):
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path == os.pardir or path.startswith(os.pardir + os.sep):
+        raise ValueError("Archive {url} contains a file outside of the extraction directory: {name}"
+            .format(url=archive_url, name=name))
+
+
+def _extract_tar(stream, extract_dir, url):
+    import tarfile
+    # Streaming mode ("r|*") reads the archive sequentially without seeking, and detects compression
+    with tarfile.open(fileobj=stream, mode="r|*") as archive:
+        if hasattr(tarfile, "data_filter"):
+            # Python 3.12+ (and security updates of earlier versions) also sanitize file modes and link targets
+            archive.extraction_filter = tarfile.data_filter
+        for member in archive:
+            _check_member_path(member.name, url)
+            if member.issym():
+                _check_member_path(os.path.join(os.path.dirname(member.name), member.linkname), url)
+            elif member.islnk():
+                _check_member_path(member.linkname, url)
+            elif not (member.isfile() or member.isdir()):
+                logger.warning("skip special file {name} in archive {url}".format(name=member.name, url=url))
+                continue
+            archive.extract(member, extract_dir)
+
+
+def _extract_zip(stream, extract_dir, url):
+    import shutil
+    import tempfile
+    import zipfile
+    # Zip archives have their index at the end, so they are spooled to disk rather than buffered in memory
+    with tempfile.TemporaryFile(dir=os.path.dirname(extract_dir)) as spool_file:
+        shutil.copyfileobj(stream, spool_file, chunk_size)
+        spool_file.seek(0)
+        with zipfile.ZipFile(spool_file) as archive:
+            for member in archive.infolist():
+                _check_member_path(member.filename, url)
+                archive.extract(member, extract_dir)
+                mode = (member.external_attr >> 16) & 0o777
+                if mode != 0 and not member.filename.endswith("/"):
+                    os.chmod(os.path.join(extract_dir, member.filename), mode)
+
+
+def _make_read_only(path):
+    r"""Removes write permissions from a file, keeping other permissions such as the executable bits."""
+
+    import stat
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & 0o222:
+        os.chmod(path, mode & ~0o222)
+
+
+def download(url, sha256, offline=False):
+    r"""Downloads and extracts an archive into the user-level archive cache.
+
+    The archive is extracted while it is downloaded, and its SHA-256 checksum is verified before the extracted tree
+    is moved into the cache. Cached trees are addressed by checksum, so an archive is never downloaded twice, even if
+    it is referenced by several projects or from several URLs. If all files of the archive are in a single top-level
+    directory, the directory is stripped. Cached files are read-only, because projects use them through hard links.
+
+    :param str url: URL of a tarball (optionally compressed with gzip, bzip2 or xz) or a zip archive.
+    :param str sha256: expected SHA-256 checksum of the archive file as a hex string.
+    :param bool offline: if True, never access the network, and fail if the archive is not cached.
+    :returns: directory with the extracted archive.
+    """
+
+    extract_dir = get_extract_dir(sha256)
+    if os.path.isdir(extract_dir):
+        logger.debug("use cached archive {url} from {path}".format(url=url, path=extract_dir))
+        return extract_dir
+    elif offline:
+        raise EnvironmentError("Archive {url} is not available offline in archive cache {path}".format(
+            url=url, path=extract_dir))
+
+    import shutil
+    import tempfile
+    from six.moves.urllib.request import urlopen
+    cache_dir = os.path.dirname(extract_dir)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Directory could be concurrently created by another process
+            if not os.path.isdir(cache_dir):
+                raise
+
+    temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+    try:
+        stream = urlopen(url)
+        try:
+            reader = _HashingReader(stream)
+            if _is_zip(url):
+                _extract_zip(reader, temp_dir, url)
+            else:
+                _extract_tar(reader, temp_dir, url)
+            # Hash the trailing padding of the archive too
+            checksum = reader.drain()
+        finally:
+            stream.close()
+
+        if checksum != sha256.lower():
+            raise ValueError("Checksum mismatch for archive {url}: expected SHA-256 {expected}, got {actual}"
+                .format(url=url, expected=sha256.lower(), actual=checksum))
+
+        tree_dir = temp_dir
+        entries = os.listdir(temp_dir)
+        if len(entries) == 1 and os.path.isdir(os.path.join(temp_dir, entries[0])):
+            tree_dir = os.path.join(temp_dir, entries[0])
+        for dirpath, dirnames, filenames in os.walk(tree_dir):
+            for filename in filenames:
+                if not os.path.islink(os.path.join(dirpath, filename)):
+                    _make_read_only(os.path.join(dirpath, filename))
+        try:
+            os.rename(tree_dir, extract_dir)
+        except OSError:
+            # Concurrently extracted by another process
+            if not os.path.isdir(extract_dir):
+                raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return extract_dir
+
+
+def link_tree(source_dir, target_dir):
+    r"""Recreates a directory tree with hard links to the source files.
+
+    Hard-linked files are shared with the source tree, and are made read-only so that modifications in place can't
+    change the source files. Files are copied instead if hard links are not supported, e.g. across file systems, and
+    copies stay writable.
+    """
+
+    import shutil
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        relpath = os.path.relpath(dirpath, source_dir)
+        target_dirpath = os.path.normpath(os.path.join(target_dir, relpath))
+        os.makedirs(target_dirpath)
+        for filename in filenames:
+            source_path = os.path.join(dirpath, filename)
+            target_path = os.path.join(target_dirpath, filename)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+                continue
+            # Files in archive caches of older versions may be writable
+            _make_read_only(source_path)
+            try:
+                os.link(source_path, target_path)
+            except OSError:
+                import stat
+                shutil.copy2(source_path, target_path)
+                os.chmod(target_path, stat.S_IMODE(os.stat(target_path).st_mode) | stat.S_IWUSR)
+        for dirname in list(dirnames):
+            if os.path.islink(os.path.join(dirpath, dirname)):
+                os.symlink(os.readlink(os.path.join(dirpath, dirname)), os.path.join(target_dirpath, dirname))
+                dirnames.remove(dirname)
+
+
+def extract(url, sha256, path, offline=False):
+    r"""Downloads and extracts an archive into a directory.
+
+    Files are hard-linked from the user-level archive cache (see :func:`download`).
+
+    :param str url: URL of the archive.
+    :param str sha256: expected SHA-256 checksum of the archive file.
+    :param str path: directory to extract the archive into. Must not exist.
+    :param bool offline: if True, extract only from the archive cache, and fail if the archive is not cached.
+    """
+
+    extract_dir = download(url, sha256, offline=offline)
+    link_tree(extract_dir, path)
@@ -5,6 +5,10 @@ import six
 
 logger = logging.getLogger("confu")
 
+# Memory which a link or a compilation of a heavy source may take, used to derive the default sizes of ninja pools
+link_job_memory = 4 * 1024**3
+heavy_job_memory = 2 * 1024**3
+
 from confu.builds.state import State
 
 
@@ -34,6 +38,9 @@ class Build(State):
 
     @staticmethod
     def from_options(options, root_dir=None, **kwargs):
+        from confu import setup_console_logging
+        setup_console_logging()
+
         from confu.utils import get_root_dir
         if root_dir is None:
             root_dir = get_root_dir()
@@ -43,34 +50,75 @@ class Build(State):
             confu.globals.root_dir = root_dir
             logger.info("detected root directory: " + root_dir)
 
+            # Dependencies are configured for the same target and toolchain as the top-level project
+            confu.globals.dependency_args = ["--target", options.target.name, "--toolchain", options.toolchain]
+
         from confu.platform import host
         if options.target.is_emscripten:
             from confu.builds import EmscriptenBuild
-            return EmscriptenBuild(root_dir, options.target, options.toolchain)
+            build = EmscriptenBuild(root_dir, options.target, options.toolchain)
         elif options.target == host or options.target.is_nacl or options.target.is_android:
             from confu.builds import UnixBuild, PNaClBuild
             if options.target.is_pnacl:
-                return PNaClBuild(root_dir, options.target, options.toolchain)
+                build = PNaClBuild(root_dir, options.target, options.toolchain)
             else:
-                return UnixBuild(root_dir, options.target, options.toolchain)
+                build = UnixBuild(root_dir, options.target, options.toolchain)
         else:
             raise ValueError("Unsupported target platform {target}".format(target=options.target.name))
 
+        build._apply_options(options)
+
+        configure_jobs = getattr(options, "configure_jobs", 1)
+        if root_dir == confu.globals.root_dir and configure_jobs > 1:
+            from confu.builds.deps import configure_dependencies
+            configure_dependencies(build.deps._deps_dir, options.target, configure_jobs)
+
+        return build
+
+    def _apply_options(self, options):
+        r"""Applies build options from the command line which are not specific to a target or toolchain."""
+
+        import confu.globals
+        if self.root_dir == confu.globals.root_dir:
+            # Only the top-level project generates build rules
+            confu.globals.object_cache = getattr(options, "object_cache", False)
+            confu.globals.relocatable = getattr(options, "relocatable", False)
+            confu.globals.profile = getattr(options, "profile", None)
+            from confu.utils import get_pool_depth
+            confu.globals.link_jobs = getattr(options, "link_jobs", None) or get_pool_depth(link_job_memory)
+            confu.globals.heavy_jobs = getattr(options, "heavy_jobs", None) or get_pool_depth(heavy_job_memory)
+            if confu.globals.link_jobs < 1 or confu.globals.heavy_jobs < 1:
+                raise ValueError("Invalid number of parallel jobs: at least 1 expected")
+            logger.debug("link pool: {link} jobs, heavy pool: {heavy} jobs".format(
+                link=confu.globals.link_jobs, heavy=confu.globals.heavy_jobs))
+            confu.globals.unity = getattr(options, "unity", 0)
+            if confu.globals.unity < 0:
+                raise ValueError("Invalid number of sources in a unity translation unit: {count}"
+                    .format(count=confu.globals.unity))
+            if confu.globals.relocatable:
+                # Relocatable builds use different paths in build rules of dependencies
+                confu.globals.dependency_args.append("--relocatable")
+            cxx_modules = getattr(options, "cxx_modules", "none")
+            confu.globals.cxx_modules = cxx_modules if cxx_modules != "none" else None
+            if confu.globals.cxx_modules is not None:
+                # C++ sources of dependencies are compiled with different rules
+                confu.globals.dependency_args.append("--cxx-modules=" + cxx_modules)
+
     @property
     def active_module(self):
         return self.modules._active
 
     def cc(self, source_path):
         raise EnvironmentError("Compilation of C codes is not supported for {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def cxx(self, source_path):
         raise EnvironmentError("Compilation of C++ codes is not supported for {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def peachpy(self, source_path):
         raise EnvironmentError("Compilation of PeachPy codes is not supported for {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def export_cpath(self, include_dir, include_paths, add_to_include_dirs=True):
         from confu.validators import validate_include_dir
@@ -81,78 +129,116 @@ class Build(State):
 
     def static_library(self, name, object_files):
         raise EnvironmentError("Static libraries are not supported for {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def dynamic_library(self, name, object_files):
         raise EnvironmentError("Dynamically loaded or shared libraries are not supported on {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def library(self, name, object_files):
         raise EnvironmentError("Function libraries are not supported for {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def plugin(self, name, object_files):
         raise EnvironmentError("Plugin modules are not supported on {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def executable(self, name, object_files):
         import confu.platform
         raise EnvironmentError("Executables are not supported on {target}"
-                               .format(target=options.target.name))
+                               .format(target=self.target.name))
 
     def unittest(self, name, object_files):
         import confu.platform
-        if confu.platform.host == options.target:
+        if confu.platform.host == self.target:
             raise EnvironmentError("Unit tests are not supported on {target}"
-                                   .format(target=options.target.name))
+                                   .format(target=self.target.name))
         else:
             raise EnvironmentError("Unit tests are not supported in cross-compilation from {host} to {target}"
-                                   .format(host=confu.platform.host, target=options.target.name))
+                                   .format(host=confu.platform.host, target=self.target.name))
 
     def smoketest(self, name, object_files):
         import confu.platform
-        if confu.platform.host == options.target:
+        if confu.platform.host == self.target:
             raise EnvironmentError("Smoke tests are not supported on {target}"
-                                   .format(target=options.target.name))
+                                   .format(target=self.target.name))
         else:
             raise EnvironmentError("Smoke tests are not supported in cross-compilation from {host} to {target}"
-                                   .format(host=confu.platform.host, target=options.target.name))
+                                   .format(host=confu.platform.host, target=self.target.name))
 
     def benchmark(self, name, object_files):
         import confu.platform
-        if confu.platform.host == options.target:
+        if confu.platform.host == self.target:
             raise EnvironmentError("Benchmarks are not supported on {target}"
-                                   .format(target=options.target.name))
+                                   .format(target=self.target.name))
         else:
             raise EnvironmentError("Benchmarks are not supported in cross-compilation from {host} to {target}"
-                                   .format(host=confu.platform.host, target=options.target.name))
+                                   .format(host=confu.platform.host, target=self.target.name))
 
     def generate(self):
         import ninja_syntax
         import confu.globals
         confu.globals.build_ninja_path = os.path.join(self.root_dir, "build.ninja")
-        with open(confu.globals.build_ninja_path, "w") as build_ninja:
+        build_ninja = six.StringIO()
+
+        if confu.globals.cxx_modules == "named":
+            # Minimal version with dyndep support
+            build_ninja.write("ninja_required_version = 1.10\n")
+        else:
             # Minimal version with implicit outputs support
             build_ninja.write("ninja_required_version = 1.7\n")
 
-            ninja = ninja_syntax.Writer(build_ninja)
-            self.generate_variables(ninja)
-            self.generate_rules(ninja)
+        ninja = ninja_syntax.Writer(build_ninja)
+        self.generate_variables(ninja)
+        # Links and heavy compilations are limited by memory rather than by processors
+        ninja.pool("link", confu.globals.link_jobs)
+        ninja.pool("heavy", confu.globals.heavy_jobs)
+        self.generate_rules(ninja)
+
+        import sys
+        configure_path = os.path.abspath(os.path.normpath(sys.argv[0]))
+        args = sys.argv[1:]
+        # build.ninja is rewritten only if it changes, and restat lets ninja skip the reload otherwise
+        ninja.rule("configure", configure_path + " $args",
+            description="CONFIGURE $args", pool="console", generator=True, restat=True)
+        ninja.rule("clean", "ninja -f $config -t clean",
+            description="CLEAN", pool="console")
+
+        ninja.build("clean", "clean",
+            variables={"config": confu.globals.build_ninja_path})
+
+        self.modules._record(ninja)
+        if confu.globals.pgo == "generate":
+            self.toolchain.write_pgo_training(ninja, self.modules._get_training_binaries(ninja))
+        if confu.globals.cxx_module_scans:
+            from confu.cxxmodules import generate_collation
+            generate_collation(ninja, confu.globals.cxx_module_scans)
+
+        # Files written during configuration are known only after build edges are recorded
+        from confu.utils import get_build_path
+        ninja.build("build.ninja", "configure", self.get_configure_inputs(configure_path),
+            implicit_outputs=[get_build_path(path) for path in sorted(set(confu.globals.configure_outputs))],
+            variables={"args": " ".join(args)})
+
+        from confu.utils import write_if_changed
+        if write_if_changed(confu.globals.build_ninja_path, build_ninja.getvalue()):
+            logger.debug("updated " + confu.globals.build_ninja_path)
+
+        logger.debug("file system cache: {hits} hits, {misses} misses".format(
+            hits=confu.globals.stat_cache_hits, misses=confu.globals.stat_cache_misses))
+
+    def get_configure_inputs(self, configure_path):
+        r"""Lists files read during configuration: configuration scripts and manifests of the project and its
+        dependencies, and built-in recipe modules. Changes in any of these files make ninja re-run configuration."""
 
-            import sys
-            configure_path = os.path.abspath(os.path.normpath(sys.argv[0]))
-            args = sys.argv[1:]
-            ninja.rule("configure", configure_path + " $args",
-                description="CONFIGURE $args", pool="console", generator=True)
-            ninja.rule("clean", "ninja -f $config -t clean",
-                description="CLEAN", pool="console")
-
-            ninja.build("build.ninja", "configure", configure_path,
-                variables={"args": " ".join(args)})
-            ninja.build("clean", "clean",
-                variables={"config": confu.globals.build_ninja_path})
-
-            self.modules._record(ninja)
+        import confu.globals
+        from confu.builds.fragments import get_configure_path
+        inputs = [configure_path, os.path.join(self.root_dir, "confu.yaml")]
+        deps_dir = os.path.join(confu.globals.root_dir, "deps")
+        for name in sorted(confu.globals.deps):
+            dep_dir = os.path.join(deps_dir, name)
+            inputs += [get_configure_path(name, dep_dir), os.path.join(dep_dir, "confu.yaml")]
+        return [path for path in inputs if path is not None and os.path.isfile(path)]
 
     def generate_variables(self, ninja):
         raise NotImplementedError()
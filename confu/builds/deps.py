@@ -17,52 +17,192 @@ class DependencyCollection:
         import confu.globals
         self._deps = [dep.name for dep in manifest.deps]
         self._deps_dir = os.path.join(confu.globals.root_dir, "deps")
-        self._target = target.name
+        self._target = target
 
     def __getattr__(self, name):
         if name not in self._deps:
             raise ValueError("Project manifest does not list dependency {name}".format(name=name))
 
-        import confu.globals
-        if name in confu.globals.deps:
-            return confu.globals.deps[name]
-
-        logger.info("configuring dependency {name}".format(name=name))
-
-        import confu.recipes
-        dep_dir = os.path.join(self._deps_dir, name)
-        if os.path.isfile(os.path.join(dep_dir, "configure.py")):
-            import sys
-            sys.path.insert(0, dep_dir)
-            try:
-                import configure
-
-                if sys.version_info >= (3, 4):
-                    from importlib import reload  # Python 3.4+
-                elif sys.version_info >= (3, 0):
-                    from imp import reload        # Python 3.0 - 3.3
-                else:
-                    global reload
-
-                reload(configure)
-                config = configure.main(["--target", self._target])
-                config.modules._sealed = True
-                confu.globals.deps[name] = config.modules
-                return config.modules
-            finally:
-                sys.path = sys.path[1:]
-        elif name in confu.recipes.__dict__:
-            configure = confu.recipes.__dict__[name]
-            config = configure.main(["--target", self._target], root_dir=dep_dir)
-            config.modules._sealed = True
-            confu.globals.deps[name] = config.modules
-            return config.modules
+        return resolve_dependency(name, self._deps_dir, self._target)
+
+
+# Serialized configuration results of dependencies, configured in worker processes
+_prefetched = dict()
+
+
+def get_dependency_graph(root_dir, deps_dir):
+    r"""Resolves the graph of (transitive) dependencies from project manifests.
+
+    :returns: a dictionary which maps names of dependencies to lists of their own dependencies.
+    """
+
+    from confu.manifest import Project
+    graph = dict()
+    pending = [dep.name for dep in Project.from_root(root_dir).deps]
+    while pending:
+        name = pending.pop()
+        if name in graph:
+            continue
+
+        dep_dir = os.path.join(deps_dir, name)
+        if os.path.isfile(os.path.join(dep_dir, "confu.yaml")):
+            graph[name] = [dep.name for dep in Project.from_root(dep_dir).deps]
         else:
-            logger.fatal("don't know how to build {name}: configure.py not found in {path}"
-                .format(name=name, path=dep_dir))
+            graph[name] = list()
+        pending += graph[name]
+    return graph
+
+
+def _configure_dependency_worker(root_dir, name, deps_dir, target, args):
+    import confu.globals
+    confu.globals.root_dir = root_dir
+    confu.globals.dependency_args = args
+    try:
+        from confu.builds import fragments
+        modules = resolve_dependency(name, deps_dir, target)
+        tool_names = sorted(confu.globals.tools)
+        data = fragments.dumps(name, modules)
+        return name, (tool_names, data), None
+    except:
+        import traceback
+        return name, None, traceback.format_exc()
+
+
+def configure_dependencies(deps_dir, target, jobs):
+    r"""Configures all dependencies of the project in a pool of worker processes.
+
+    Dependencies are scheduled for configuration as soon as all of their own dependencies are configured. Workers
+    share configuration results through the configuration cache (see :mod:`confu.builds.fragments`), and send
+    serialized results back to the parent process, where they are deserialized on first use.
+    Dependencies which can not be cached, or fail to configure in a worker, are left to be configured lazily.
+
+    :param int jobs: maximum number of dependencies to configure in parallel.
+    """
+
+    import confu.globals
+    from confu.builds import fragments
+    args = get_dependency_args(target)
+    graph = get_dependency_graph(confu.globals.root_dir, deps_dir)
+    fingerprints = {name: fragments.fingerprint(name, deps_dir, args) for name in graph}
+
+    configured = set(name for name in graph if name in confu.globals.deps or name in _prefetched or
+        fingerprints[name] is not None and fragments.is_cached(name, fingerprints[name]))
+    pending = set(name for name in graph if name not in configured and fingerprints[name] is not None)
+    if not pending:
+        return
 
-            import errno
-            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT),
-                os.path.join(dep_dir, "configure.py"))
+    jobs = min(jobs, len(pending))
+    logger.info("configuring {count} dependencies using {jobs} processes".format(count=len(pending), jobs=jobs))
 
+    import multiprocessing
+    if sys.version_info >= (3, 4) and "fork" in multiprocessing.get_all_start_methods():
+        # Other start methods would re-import the top-level configuration script in every worker
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+    else:
+        pool = multiprocessing.Pool(jobs)
+
+    from six.moves import queue
+    completed = queue.Queue()
+    running = 0
+    try:
+        while True:
+            for name in sorted(pending):
+                if all(dep in configured for dep in graph[name]):
+                    pending.remove(name)
+                    running += 1
+                    pool.apply_async(_configure_dependency_worker,
+                        (confu.globals.root_dir, name, deps_dir, target, args), callback=completed.put)
+            if running == 0:
+                break
+
+            name, fragment, error = completed.get()
+            running -= 1
+            if fragment is not None:
+                _prefetched[name] = fragment
+                configured.add(name)
+            else:
+                logger.warning("failed to configure dependency {name} in a worker process:\n{error}"
+                    .format(name=name, error=error))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_dependency_args(target):
+    import confu.globals
+    if confu.globals.dependency_args is not None:
+        return list(confu.globals.dependency_args)
+    else:
+        return ["--target", target.name]
+
+
+def resolve_dependency(name, deps_dir, target):
+    import confu.globals
+    if name in confu.globals.deps:
+        return confu.globals.deps[name]
+
+    from confu.builds import fragments
+    if name in _prefetched:
+        tool_names, data = _prefetched.pop(name)
+        modules = fragments.restore(name, tool_names, data, target,
+            lambda dep_name: resolve_dependency(dep_name, deps_dir, target))
+        if modules is not None:
+            confu.globals.deps[name] = modules
+            return modules
+
+    args = get_dependency_args(target)
+    fingerprint = fragments.fingerprint(name, deps_dir, args)
+    if fingerprint is not None:
+        modules = fragments.load(name, fingerprint, target,
+            lambda dep_name: resolve_dependency(dep_name, deps_dir, target))
+        if modules is not None:
+            logger.info("reuse cached configuration of dependency {name}".format(name=name))
+            confu.globals.deps[name] = modules
+            return modules
+
+    logger.info("configuring dependency {name}".format(name=name))
+
+    tool_names = set(confu.globals.tools)
+    modules = configure_dependency(name, deps_dir, args)
+    confu.globals.deps[name] = modules
+
+    if fingerprint is not None:
+        fragments.store(name, fingerprint, modules, set(confu.globals.tools) - tool_names)
+
+    return modules
+
+
+def configure_dependency(name, deps_dir, args):
+    import confu.recipes
+    dep_dir = os.path.join(deps_dir, name)
+    if os.path.isfile(os.path.join(dep_dir, "configure.py")):
+        import sys
+        sys.path.insert(0, dep_dir)
+        try:
+            import configure
+
+            if sys.version_info >= (3, 4):
+                from importlib import reload  # Python 3.4+
+            elif sys.version_info >= (3, 0):
+                from imp import reload        # Python 3.0 - 3.3
+            else:
+                global reload
+
+            reload(configure)
+            config = configure.main(args)
+            config.modules._sealed = True
+            return config.modules
+        finally:
+            sys.path = sys.path[1:]
+    elif name in confu.recipes.__dict__:
+        configure = confu.recipes.__dict__[name]
+        config = configure.main(args, root_dir=dep_dir)
+        config.modules._sealed = True
+        return config.modules
+    else:
+        logger.fatal("don't know how to build {name}: configure.py not found in {path}"
+            .format(name=name, path=dep_dir))
 
+        import errno
+        raise IOError(errno.ENOENT, os.strerror(errno.ENOENT),
+            os.path.join(dep_dir, "configure.py"))
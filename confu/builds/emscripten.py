@@ -70,17 +70,18 @@ class EmscriptenBuild(UnixBuild):
             else:
                 emflags += ["-s", "NO_FILESYSTEM=1"]
 
+        from confu.utils import get_build_path
         extra_deps = list()
         if pre_js is not None:
             from confu.validators import validate_source_paths
             for js_path in validate_source_paths(pre_js, self.source_dir):
                 extra_deps.append(js_path)
-                emflags += ["--pre-js", js_path]
+                emflags += ["--pre-js", get_build_path(js_path)]
         if post_js is not None:
             from confu.validators import validate_source_paths
             for js_path in validate_source_paths(post_js, self.source_dir):
                 extra_deps.append(js_path)
-                emflags += ["--post-js", js_path]
+                emflags += ["--post-js", get_build_path(js_path)]
 
         plugin = CollectionResult("out", name, object_files,
             libraries=self._deps_libraries, filename=filename,
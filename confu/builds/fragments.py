@@ -0,0 +1,304 @@
+from __future__ import absolute_import
+
+import os
+import logging
+
+import six
+
+
+logger = logging.getLogger("confu")
+
+
+# Environment variables that affect how toolchains (and thus configuration results) are detected
+fingerprint_env_vars = ["ANDROID_SDK", "ANDROID_NDK", "NACL_SDK_ROOT", "EMSCRIPTEN"]
+
+# Number of fingerprints cached per dependency, e.g. for different targets
+max_cached_fingerprints = 4
+
+_fingerprints = dict()
+_result_indices = dict()
+_confu_fingerprint = None
+
+
+def get_cache_dir():
+    import confu.globals
+    return os.path.join(confu.globals.root_dir, "build", ".confu", "deps")
+
+
+def get_configure_path(name, dep_dir):
+    configure_path = os.path.join(dep_dir, "configure.py")
+    if os.path.isfile(configure_path):
+        return configure_path
+
+    import confu.recipes
+    if name in confu.recipes.__dict__:
+        configure_path = confu.recipes.__dict__[name].__file__
+        if configure_path.endswith((".pyc", ".pyo")):
+            configure_path = configure_path[:-1]
+        return configure_path
+
+
+def _hash_file(hash, path):
+    if path is None or not os.path.isfile(path):
+        hash.update(b"\0")
+    else:
+        with open(path, "rb") as file:
+            hash.update(file.read())
+        hash.update(b"\1")
+
+
+def _get_confu_fingerprint():
+    global _confu_fingerprint
+    if _confu_fingerprint is None:
+        # Pickled configuration results are only valid for the confu sources which produced them
+        import hashlib
+        import confu
+        hash = hashlib.sha1()
+        confu_dir = os.path.dirname(os.path.abspath(confu.__file__))
+        for dirpath, dirnames, filenames in os.walk(confu_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".py"):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    hash.update("{path}:{size}:{mtime}\n".format(
+                        path=os.path.join(dirpath, filename), size=stat.st_size, mtime=stat.st_mtime).encode("utf-8"))
+        _confu_fingerprint = hash.hexdigest()
+    return _confu_fingerprint
+
+
+def fingerprint(name, deps_dir, args):
+    r"""Computes a fingerprint of dependency configuration.
+
+    The fingerprint covers the configuration script and manifest of the dependency, configuration arguments (target
+    and toolchain), relevant environment variables, and fingerprints of all dependencies listed in its manifest.
+
+    :param str name: name of the dependency.
+    :param str deps_dir: directory with dependency packages.
+    :param list args: arguments passed to the configuration script of the dependency.
+
+    :returns: a hex string with the fingerprint, or None if the dependency can not be cached.
+    """
+
+    key = (name, tuple(args))
+    if key in _fingerprints:
+        return _fingerprints[key]
+
+    # Guard against dependency cycles
+    _fingerprints[key] = None
+
+    dep_dir = os.path.join(deps_dir, name)
+    configure_path = get_configure_path(name, dep_dir)
+    manifest_path = os.path.join(dep_dir, "confu.yaml")
+    if configure_path is None or not os.path.isfile(manifest_path):
+        return None
+
+    import hashlib
+    hash = hashlib.sha1()
+    hash.update(_get_confu_fingerprint().encode("utf-8"))
+    hash.update(os.path.abspath(dep_dir).encode("utf-8") + b"\0")
+    hash.update(" ".join(args).encode("utf-8") + b"\0")
+    for env_var in fingerprint_env_vars:
+        hash.update("{name}={value}\0".format(name=env_var, value=os.getenv(env_var, "")).encode("utf-8"))
+    _hash_file(hash, os.path.expanduser("~/.emscripten"))
+    _hash_file(hash, configure_path)
+    _hash_file(hash, manifest_path)
+
+    from confu.manifest import Project
+    try:
+        manifest = Project.from_root(dep_dir)
+    except:
+        return None
+    for dep in manifest.deps:
+        dep_fingerprint = fingerprint(dep.name, deps_dir, args)
+        if dep_fingerprint is None:
+            return None
+        hash.update("{name}:{fingerprint}\n".format(name=dep.name, fingerprint=dep_fingerprint).encode("utf-8"))
+
+    _fingerprints[key] = hash.hexdigest()
+    return _fingerprints[key]
+
+
+def _iter_results(modules):
+    from confu.results import BuildResult, CollectionResult
+
+    def iter_result(result):
+        yield result
+        if isinstance(result, CollectionResult):
+            for obj in result.objects:
+                for subresult in iter_result(obj):
+                    yield subresult
+            for library in result.libraries or list():
+                if isinstance(library, BuildResult):
+                    for subresult in iter_result(library):
+                        yield subresult
+
+    for module in modules:
+        for artifacts in (module.libraries, module.plugins, module.executables,
+                          module.unittests, module.smoketests, module.benchmarks):
+            for artifact in artifacts:
+                for result in iter_result(artifact):
+                    yield result
+
+
+def _get_result_key(result):
+    from confu.results import CollectionResult
+    if isinstance(result, CollectionResult):
+        return result.get_target_path()
+    else:
+        return result.get_object_path()
+
+
+def _get_result_index(name):
+    if name not in _result_indices:
+        import confu.globals
+        _result_indices[name] = {_get_result_key(result): result for result in _iter_results(confu.globals.deps[name])}
+    return _result_indices[name]
+
+
+def dumps(name, modules):
+    r"""Serializes configuration results of a dependency.
+
+    Build results which belong to other dependencies are stored as references, and resolved against
+    confu.globals.deps when the results are deserialized.
+    """
+
+    import confu.globals
+    foreign_results = dict()
+    for dep_name, dep_modules in six.iteritems(confu.globals.deps):
+        if dep_name != name:
+            for result in _iter_results(dep_modules):
+                foreign_results[id(result)] = (dep_name, _get_result_key(result))
+
+    def persistent_id(obj):
+        reference = foreign_results.get(id(obj))
+        if reference is not None:
+            return "\0".join(reference)
+
+    from six.moves import cPickle as pickle
+    buffer = six.BytesIO()
+    pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(modules)
+    return buffer.getvalue()
+
+
+def loads(data, resolve):
+    r"""Deserializes configuration results of a dependency.
+
+    :param bytes data: serialized configuration results produced by :func:`dumps`.
+    :param resolve: a function which takes dependency name and makes sure the dependency is configured.
+    """
+
+    import confu.globals
+
+    def persistent_load(reference):
+        if isinstance(reference, bytes):
+            reference = reference.decode("utf-8")
+        dep_name, key = reference.split("\0", 1)
+        if dep_name not in confu.globals.deps:
+            resolve(dep_name)
+        return _get_result_index(dep_name)[key]
+
+    from six.moves import cPickle as pickle
+    unpickler = pickle.Unpickler(six.BytesIO(data))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def get_cache_path(name, fingerprint):
+    return os.path.join(get_cache_dir(), "{name}-{fingerprint}.pickle".format(name=name, fingerprint=fingerprint))
+
+
+def is_cached(name, fingerprint):
+    return os.path.isfile(get_cache_path(name, fingerprint))
+
+
+def restore(name, tool_names, data, target, resolve):
+    r"""Restores configuration results of a dependency serialized with :func:`dumps`.
+
+    :param list tool_names: names of tools which the dependency needs to generate its build rules.
+    :returns: ModuleCollection for the dependency, or None if the results could not be deserialized.
+    """
+
+    try:
+        modules = loads(data, resolve)
+    except Exception as e:
+        logger.warning("failed to load cached configuration of dependency {name}: {message}".format(
+            name=name, message=str(e)))
+        return None
+
+    import confu.globals
+    from confu.tools import Tool
+    for tool_name in tool_names:
+        if tool_name not in confu.globals.tools:
+            confu.globals.tools[tool_name] = Tool.for_name(tool_name, target)
+
+    return modules
+
+
+def load(name, fingerprint, target, resolve):
+    r"""Loads cached configuration results of a dependency.
+
+    :returns: ModuleCollection for the dependency, or None if the cache doesn't contain results for this fingerprint.
+    """
+
+    cache_path = get_cache_path(name, fingerprint)
+    if not os.path.isfile(cache_path):
+        return None
+
+    from six.moves import cPickle as pickle
+    try:
+        with open(cache_path, "rb") as cache_file:
+            tool_names, data = pickle.load(cache_file)
+    except Exception as e:
+        logger.warning("failed to load cached configuration of dependency {name}: {message}".format(
+            name=name, message=str(e)))
+        return None
+
+    modules = restore(name, tool_names, data, target, resolve)
+    if modules is not None:
+        # Refresh modification time: it orders cached configurations for eviction
+        os.utime(cache_path, None)
+    return modules
+
+
+def store(name, fingerprint, modules, tool_names):
+    r"""Stores configuration results of a dependency in the cache.
+
+    :param list tool_names: names of tools (e.g. peachpy) which the dependency needs to generate its build rules.
+    :returns: serialized configuration results, or None if the results could not be serialized.
+    """
+
+    try:
+        data = dumps(name, modules)
+    except Exception as e:
+        logger.warning("failed to cache configuration of dependency {name}: {message}".format(
+            name=name, message=str(e)))
+        return None
+
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Directory could be concurrently created by another configuration process
+            if not os.path.isdir(cache_dir):
+                raise
+
+    cache_path = get_cache_path(name, fingerprint)
+    from six.moves import cPickle as pickle
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix="." + name + "-")
+    with os.fdopen(fd, "wb") as cache_file:
+        pickle.dump((sorted(tool_names), data), cache_file, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, cache_path)
+
+    # Keep only a few most recently used configurations of each dependency
+    cached_paths = [os.path.join(cache_dir, filename) for filename in os.listdir(cache_dir)
+                    if filename.startswith(name + "-") and filename.endswith(".pickle")
+                    and len(filename) == len(name) + 1 + len(fingerprint) + len(".pickle")]
+    cached_paths.sort(key=os.path.getmtime, reverse=True)
+    for stale_path in cached_paths[max_cached_fingerprints:]:
+        os.remove(stale_path)
+
+    return data
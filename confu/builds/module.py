@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import weakref
 import logging
+import collections
 
 
 logger = logging.getLogger("confu")
@@ -27,6 +28,14 @@ class ModuleCollection:
     def __repr__(self):
         return str(self)
 
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for module in self:
+            module._modules = weakref.ref(self)
+
     def __getattr__(self, name):
         if name.startswith("__") and name.endswith("__"):
             # Query for built-in method, e.g. dir
@@ -59,6 +68,16 @@ class ModuleCollection:
             ninja.build("test", "phony", tests)
 
 
+    def _get_training_binaries(self, ninja):
+        r"""Lists names and paths of benchmarks and smoke tests, which run to collect profiles for PGO."""
+
+        binaries = list()
+        for module in self:
+            for binary in module.benchmarks + module.smoketests:
+                binaries.append((binary.name, binary.generate(ninja)))
+        return binaries
+
+
 class Module:
     r"""Module is a container for build artifacts, and the minimal dependency that can be imported from a package.
 
@@ -146,13 +165,24 @@ class Module:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._modules()._active = self._saved_active
 
+    def __getstate__(self):
+        # Weak reference to the parent collection can't be pickled, ModuleCollection restores it
+        state = self.__dict__.copy()
+        state["_modules"] = None
+        state["_saved_active"] = None
+        return state
+
     def _record(self, ninja):
         defaults = list()
 
+        # Static and shared variants of a library have the same name
+        library_targets = collections.OrderedDict()
         for library in self.libraries:
             target = library.generate(ninja)
             defaults.append(target)
-            ninja.build(library.name, "phony", target)
+            library_targets.setdefault(library.name, list()).append(target)
+        for name, targets in library_targets.items():
+            ninja.build(name, "phony", targets)
 
         for plugin in self.plugins:
             target = plugin.generate(ninja)
@@ -7,7 +7,8 @@ from confu.isa import InstructionSet
 
 class OptionsContextManager:
     def __init__(self, state, source_dir=None, include_dirs=None, extra_include_dirs=None,
-            macros=None, extra_macros=None, isa=None, deps=None, libs=None):
+            macros=None, extra_macros=None, isa=None, deps=None, libs=None, pch=None, heavy=None,
+            visibility=None):
 
         assert isinstance(state, State)
         assert include_dirs is None or extra_include_dirs is None
@@ -42,6 +43,9 @@ class OptionsContextManager:
         self.isa = isa
         self.deps = deps
         self.libs = libs
+        self.pch = pch
+        self.heavy = heavy
+        self.visibility = visibility
 
         self._saved_source_dir = None
         self._saved_include_dirs = None
@@ -49,6 +53,9 @@ class OptionsContextManager:
         self._saved_isa = None
         self._saved_deps = None
         self._saved_libs = None
+        self._saved_pch = None
+        self._saved_heavy = None
+        self._saved_visibility = None
 
     def __enter__(self):
         self._saved_source_dir = self.state._source_dir
@@ -83,6 +90,18 @@ class OptionsContextManager:
         if self.libs is not None:
             self.state._libs = self.libs
 
+        self._saved_pch = self.state._pch
+        if self.pch is not None:
+            self.state._pch = self.pch or None
+
+        self._saved_heavy = self.state._heavy
+        if self.heavy is not None:
+            self.state._heavy = self.heavy
+
+        self._saved_visibility = self.state._visibility
+        if self.visibility is not None:
+            self.state._visibility = self.visibility
+
         return self.state
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -91,6 +110,9 @@ class OptionsContextManager:
         self.state._isa = self._saved_isa
         self.state._deps = self._saved_deps
         self.state._libs = self._saved_libs
+        self.state._pch = self._saved_pch
+        self.state._heavy = self._saved_heavy
+        self.state._visibility = self._saved_visibility
 
 
 class State(object):
@@ -104,10 +126,27 @@ class State(object):
         self._isa = InstructionSet()
         self._deps = list()
         self._libs = list()
+        self._pch = None
+        self._heavy = False
+        self._visibility = "default"
 
     def options(self, source_dir=None, include_dirs=None, extra_include_dirs=None,
-            macros=None, extra_macros=None, isa=None, deps=None, libs=None):
-        
+            macros=None, extra_macros=None, isa=None, deps=None, libs=None, pch=None, heavy=None,
+            visibility=None):
+        r"""Overrides build options within a with-block.
+
+        :param str pch: path to a header to precompile and implicitly include in C and C++ sources compiled within
+            the block. A relative path is resolved like an include: in the source directory, include directories,
+            include directories of dependencies, and the root directory. Sources compiled with different macros, ISA extensions,
+            or include directories use different precompiled headers. Use pch=False to stop using a precompiled
+            header specified in an outer block.
+        :param bool heavy: if True, C and C++ sources compiled within the block are compiled in the heavy ninja pool,
+            which limits the number of parallel compilations by available memory (--heavy-jobs option).
+        :param str visibility: default visibility of symbols in C and C++ sources compiled within the block: "default",
+            or "hidden" to export from shared libraries only symbols declared with
+            __attribute__((visibility("default"))).
+        """
+
         if include_dirs is not None and extra_include_dirs is not None:
             raise ValueError("At most one of include_dirs, extra_include_dirs arguments can be provided")
 
@@ -129,11 +168,24 @@ class State(object):
             from confu.validators import validate_dependencies
             deps = validate_dependencies(deps, self)
 
+        if visibility is not None and visibility not in ["default", "hidden"]:
+            raise ValueError("Invalid visibility {visibility}: \"default\" or \"hidden\" expected"
+                .format(visibility=visibility))
+
+        if pch:
+            from confu.validators import validate_source_dir, validate_header_path
+            search_dirs = [self.source_dir if source_dir is None else validate_source_dir(source_dir, self.root_dir)]
+            search_dirs += include_dirs if include_dirs is not None else self._include_dirs + (extra_include_dirs or [])
+            search_dirs += sum((dep.cpath for dep in (deps if deps is not None else self._deps)
+                                if hasattr(dep, "cpath")), list())
+            search_dirs.append(self.root_dir)
+            pch = validate_header_path(pch, search_dirs, self.root_dir)
+
         return OptionsContextManager(self,
             source_dir=source_dir,
             include_dirs=include_dirs, extra_include_dirs=extra_include_dirs,
             macros=macros, extra_macros=extra_macros,
-            isa=isa, deps=deps, libs=libs)
+            isa=isa, deps=deps, libs=libs, pch=pch, heavy=heavy, visibility=visibility)
 
     @property
     def root_dir(self):
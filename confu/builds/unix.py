@@ -1,11 +1,16 @@
 import os
 import six
+import logging
 import collections
+from six.moves import collections_abc
 
 from confu.builds import Build
 from confu.results import CompilationResult, CollectionResult
 
 
+logger = logging.getLogger("confu")
+
+
 class UnixBuild(Build):
     def __init__(self, root_dir, target, toolchain):
         super(UnixBuild, self).__init__(root_dir, target)
@@ -34,11 +39,95 @@ class UnixBuild(Build):
             self.toolchain.ar = "ar"
             self.toolchain.ranlib = "ranlib"
             self.toolchain.strip = "strip"
+            self.toolchain.nm = "nm"
+
+        # Precompiled headers for each combination of header and compilation flags
+        self._precompiled_headers = dict()
+        # Position-independent variants of objects and static libraries, by paths of the original outputs
+        self._pic_variants = dict()
+
+    def _apply_options(self, options):
+        super(UnixBuild, self)._apply_options(options)
+
+        from confu.validators import validate_compiler_launcher
+        launcher = validate_compiler_launcher(getattr(options, "compiler_launcher", None))
+        if launcher is not None:
+            logger.debug("compiler launcher: " + launcher)
+            self.toolchain.launcher = launcher
+
+        import confu.globals
+        if confu.globals.profile is not None and self.root_dir == confu.globals.root_dir:
+            self.toolchain.set_profile(confu.globals.profile)
+
+        if confu.globals.cxx_modules is not None:
+            from confu.utils import get_build_path, get_output_dir
+            module_cache_dir = os.path.join(get_output_dir("build"), "module-cache", self.target.name)
+            self.toolchain.enable_cxx_modules(confu.globals.cxx_modules, get_build_path(module_cache_dir))
+
+        linker = getattr(options, "linker", "default")
+        if linker != "default" and self.root_dir == confu.globals.root_dir:
+            self.toolchain.select_linker(linker)
+
+        if getattr(options, "fast_link", False) and self.root_dir == confu.globals.root_dir:
+            # Object cache stores only objects, without .dwo files of split DWARF
+            split_dwarf = not confu.globals.object_cache
+            if not split_dwarf:
+                logger.warning("split DWARF is disabled: object cache doesn't support .dwo files")
+            self.toolchain.enable_fast_link(split_dwarf)
+
+        lto = getattr(options, "lto", "none")
+        if lto != "none" and self.root_dir == confu.globals.root_dir:
+            # Links share processors in the link pool
+            import multiprocessing
+            from confu.utils import get_build_path, get_output_dir
+            lto_jobs = max(1, multiprocessing.cpu_count() // confu.globals.link_jobs)
+            thinlto_cache_dir = get_build_path(os.path.join(get_output_dir("build"), "thinlto-cache"))
+            self.toolchain.enable_lto(lto, lto_jobs, thinlto_cache_dir)
+
+        pgo = getattr(options, "pgo", "none")
+        if pgo != "none" and self.root_dir == confu.globals.root_dir:
+            self._enable_pgo(pgo, options.pgo_source, options.pgo_profile)
+
+        if confu.globals.relocatable and self.root_dir == confu.globals.root_dir:
+            # Dependencies are in deps/ subdirectory of the root directory, and the same prefix map covers them
+            self.toolchain.add_prefix_map(confu.globals.root_dir, ".")
+
+    def _enable_pgo(self, mode, source, profile_path):
+        import confu.globals
+        import confu.platform
+        from confu.utils import get_build_path, get_output_dir
+        if mode == "generate" and self.target != confu.platform.host:
+            raise EnvironmentError("Profiles for {target} can't be collected on {host}: use --pgo-profile to specify "
+                                   "a profile collected on the target".format(target=self.target, host=confu.platform.host))
+        if profile_path is not None:
+            profile_path = os.path.abspath(profile_path)
+        pgo_dir = os.path.join(get_output_dir("build"), "pgo")
+        self.toolchain.enable_pgo(mode, source, get_build_path(pgo_dir),
+            profile_path=get_build_path(profile_path) if profile_path is not None else None)
+        confu.globals.pgo = mode
+
+        if mode == "use":
+            profile_path = os.path.join(confu.globals.root_dir, self.toolchain.pgo_profile)
+            if not os.path.exists(profile_path):
+                raise ValueError("Profile {path} does not exist: configure with --pgo=generate and build pgo target "
+                                 "to collect it".format(path=profile_path))
+            if os.path.isfile(profile_path):
+                # Compilations are repeated when the profile changes
+                confu.globals.compile_deps.append(self.toolchain.pgo_profile)
+            if source == "instrumentation" and self.toolchain.profdata is None and confu.globals.object_cache:
+                # Object cache can't see .gcda files, which gcc finds by object paths
+                logger.warning("object cache is disabled: it doesn't support instrumentation profiles of gcc")
+                confu.globals.object_cache = False
 
     def generate_variables(self, ninja):
         import confu.globals
-        ninja.variable("builddir", os.path.join(confu.globals.root_dir, "build"))
+        from confu.utils import get_output_dir
+        # Each profile has its own ninja log and dependency log, which keep outputs of other profiles up to date
+        ninja.variable("builddir", get_output_dir("build"))
         ninja.variable("root", confu.globals.root_dir)
+        if confu.globals.object_cache:
+            from confu.cache import get_command
+            ninja.variable("objcache", get_command())
 
         self.toolchain.write_variables(ninja)
         for tool in six.itervalues(confu.globals.tools):
@@ -51,7 +140,7 @@ class UnixBuild(Build):
         for tool in six.itervalues(confu.globals.tools):
             tool._record_rules(ninja)
 
-    def _compile(self, rule, source_path):
+    def _compile(self, rule, source_path, unity=True, heavy=False):
         from confu.validators import validate_source_path
         source_path = validate_source_path(source_path, self.source_dir)
         variables = dict()
@@ -60,26 +149,69 @@ class UnixBuild(Build):
             if hasattr(dep, "cpath"):
                 include_dirs += dep.cpath
         if include_dirs:
-            variables["includes"] = "$includes " + " ".join("-I" + include_dir for include_dir in include_dirs)
+            from confu.utils import get_build_path
+            variables["includes"] = "$includes " + \
+                " ".join("-I" + get_build_path(include_dir) for include_dir in include_dirs)
         if self._isa:
             variables["optflags"] = "$optflags " + " ".join(self._isa.get_flags(self.toolchain.cc))
         if self._macros:
             from confu.utils import format_macro
             variables["macro"] = " ".join(format_macro(name, self._macros[name]) for name in sorted(self._macros))
-        return CompilationResult(source_path, self.target, rule=rule, variables=variables)
+        if self._visibility == "hidden":
+            variables["optflags"] = variables.get("optflags", "$optflags") + " -fvisibility=hidden" + \
+                (" -fvisibility-inlines-hidden" if rule == "cxx" else "")
+        if heavy or self._heavy:
+            variables["pool"] = "heavy"
+        pch = None
+        if self._pch is not None:
+            pch = self._precompiled_header(rule, variables)
+            from confu.utils import get_build_path
+            variables["pch"] = "-Winvalid-pch -include " + get_build_path(pch.get_include_path())
+        if rule == "cxx" and self.toolchain.cxx_modules is not None:
+            from confu.results import ModuleCompilationResult
+            return ModuleCompilationResult(source_path, self.target, self.toolchain.cxx_modules,
+                variables=variables, pch=pch)
+        return CompilationResult(source_path, self.target, rule=rule, variables=variables, pch=pch, unity=unity)
+
+    def _precompiled_header(self, rule, variables):
+        # Precompiled header is valid only for sources compiled with the same flags, so every combination of flags
+        # gets its own variant of the precompiled header
+        import hashlib
+        flags = "\0".join([rule] + [variables.get(name, "") for name in ["optflags", "macro", "includes"]])
+        variant = rule + "-" + hashlib.sha256(flags.encode("utf-8")).hexdigest()[:16]
+        key = (self._pch, variant)
+        if key not in self._precompiled_headers:
+            from confu.results import PrecompiledHeaderResult
+            self._precompiled_headers[key] = PrecompiledHeaderResult(self._pch, self.target, variant,
+                rule=rule + "_pch", variables=variables.copy())
+        return self._precompiled_headers[key]
+
+    def cc(self, source_path, unity=True, heavy=False):
+        r"""Compiles a C source file.
+
+        :param bool unity: if False, always compile the source separately, even in unity builds (--unity option).
+        :param bool heavy: if True, compile the source in the heavy ninja pool (--heavy-jobs option).
+        """
+
+        return self._compile("cc", source_path, unity, heavy)
+
+    def cxx(self, source_path, unity=True, heavy=False):
+        r"""Compiles a C++ source file.
 
-    def cc(self, source_path):
-        return self._compile("cc", source_path)
+        :param bool unity: if False, always compile the source separately, even in unity builds (--unity option).
+        :param bool heavy: if True, compile the source in the heavy ninja pool (--heavy-jobs option).
+        """
 
-    def cxx(self, source_path):
-        return self._compile("cxx", source_path)
+        return self._compile("cxx", source_path, unity, heavy)
 
     def peachpy(self, source_path):
         from confu.validators import validate_source_path
         source_path = validate_source_path(source_path, self.source_dir)
 
         include_dirs = sum((dep.cpath for dep in self._deps if hasattr(dep, "cpath")), self.include_dirs)
-        return self.tools.peachpy.compile(source_path, include_dirs=include_dirs)
+        from confu.utils import get_build_path
+        return self.tools.peachpy.compile(source_path,
+            include_dirs=[get_build_path(include_dir) for include_dir in include_dirs])
 
     @property
     def _deps_libraries(self):
@@ -100,13 +232,135 @@ class UnixBuild(Build):
         self.active_module.libraries.append(library)
         return library
 
+    def _get_pic_variant(self, result):
+        r"""Returns a position-independent variant of an object or a static library.
+
+        Variants are cached, so that every object is compiled as position-independent code at most once, however many
+        shared libraries use it.
+        """
+
+        from confu.results import ModuleCompilationResult, PrecompiledHeaderResult
+        if isinstance(result, CompilationResult):
+            key = result.get_object_path()
+        elif isinstance(result, CollectionResult) and result.rule == "archive":
+            key = result.get_target_path()
+        else:
+            return result
+
+        if key not in self._pic_variants:
+            import copy
+            if isinstance(result, ModuleCompilationResult):
+                raise ValueError("C++ module {path} can't be linked into a shared library"
+                                 .format(path=result.source_file))
+            elif isinstance(result, CompilationResult):
+                pic_result = copy.copy(result)
+                pic_result.generated = False
+                pic_result.pic = True
+                pic_result.variables = result.variables.copy()
+                # Separate sections for functions and data let the linker remove unused code with --gc-sections
+                pic_result.variables["optflags"] = result.variables.get("optflags", "$optflags") + \
+                    " -fPIC -ffunction-sections -fdata-sections"
+                if isinstance(result, PrecompiledHeaderResult):
+                    pic_result.variant = result.variant + "-pic"
+                elif result.pch is not None:
+                    # Precompiled header must be compiled with the same -fPIC option
+                    from confu.utils import get_build_path
+                    pic_result.pch = self._get_pic_variant(result.pch)
+                    pic_result.variables["pch"] = "-Winvalid-pch -include " + \
+                        get_build_path(pic_result.pch.get_include_path())
+            else:
+                pic_result = CollectionResult("lib", result.name,
+                    [self._get_pic_variant(object) for object in result.objects],
+                    filename=self.target.get_static_library_filename(result.name, pic=True),
+                    libraries=[self._get_pic_variant(library) for library in result.libraries or list()],
+                    rule="archive")
+            self._pic_variants[key] = pic_result
+        return self._pic_variants[key]
+
+    def dynamic_library(self, name, object_files, exports=None, version_script=None, gc_sections=True):
+        r"""Links a shared library from position-independent variants of objects and dependency libraries.
+
+        :param exports: names of C functions and variables to export from the library. Other symbols are hidden.
+        :param str version_script: path to a linker version script, relative to the source directory. Mutually
+            exclusive with exports.
+        :param bool gc_sections: remove functions and data which exported symbols don't reference.
+        """
+
+        if self.target.is_emscripten or self.target.is_nacl or self.target.is_pnacl:
+            return super(UnixBuild, self).dynamic_library(name, object_files)
+        if exports is not None and version_script is not None:
+            raise ValueError("At most one of exports, version_script arguments can be provided")
+        if not isinstance(object_files, collections_abc.Iterable):
+            object_files = [object_files]
+
+        import confu.globals
+        from confu.utils import get_build_path, get_output_dir
+        filename = self.target.get_dynamic_library_filename(name)
+        ldflags = ["$ldflags"]
+        extra_deps = list()
+        if self.target.is_macos:
+            # Executables find the library through their rpath
+            ldflags.append("-Wl,-install_name,@rpath/" + filename)
+        else:
+            ldflags.append("-Wl,-soname," + filename)
+        if gc_sections:
+            ldflags.append("-Wl,-dead_strip" if self.target.is_macos else "-Wl,--gc-sections")
+
+        if exports is not None:
+            from confu.validators import validate_export_functions
+            exports = validate_export_functions(exports)
+            exports_dir = os.path.join(get_output_dir("build"), "exports")
+            if not os.path.isdir(exports_dir):
+                os.makedirs(exports_dir)
+            from confu.utils import write_if_changed
+            if self.target.is_macos:
+                version_script = os.path.join(exports_dir, filename + ".exp")
+                write_if_changed(version_script, "".join("_" + symbol + "\n" for symbol in exports))
+            else:
+                version_script = os.path.join(exports_dir, filename + ".map")
+                write_if_changed(version_script, "{\n  global:\n" +
+                    "".join("    " + symbol + ";\n" for symbol in exports) + "  local:\n    *;\n};\n")
+            # Ninja re-runs configuration to write the export list if it is missing
+            confu.globals.configure_outputs.append(version_script)
+        elif version_script is not None:
+            from confu.validators import validate_source_path
+            version_script = validate_source_path(version_script, self.source_dir)
+        if version_script is not None:
+            extra_deps.append(version_script)
+            if self.target.is_macos:
+                ldflags.append("-Wl,-exported_symbols_list," + get_build_path(version_script))
+            else:
+                ldflags.append("-Wl,--version-script=" + get_build_path(version_script))
+
+        interface = None
+        if self.toolchain.nm is not None:
+            interface = os.path.join(get_output_dir("build"), "interfaces", filename + ".symbols")
+
+        library = CollectionResult("lib", name, [self._get_pic_variant(object) for object in object_files],
+            filename=filename,
+            libraries=[self._get_pic_variant(library) for library in self._libs + self._deps_libraries],
+            rule="library", extra_deps=extra_deps, interface=interface,
+            variables={"linker": "$cxx", "ldflags": " ".join(ldflags)})
+        self.active_module.libraries.append(library)
+        return library
+
     def _executable(self, name, object_files):
         if not isinstance(object_files, collections.Iterable):
             object_files = [object_files]
+        libraries = self._libs + self._deps_libraries
+        variables = {"linker": "$cxx"}
+        if any(isinstance(library, CollectionResult) and library.rule == "library" for library in libraries):
+            # Shared libraries are in lib/ directory next to bin/ with executables
+            from confu.utils import get_output_dir
+            lib_dir = os.path.relpath(get_output_dir("lib"), get_output_dir("bin"))
+            if self.target.is_macos:
+                variables["ldflags"] = "$ldflags -Wl,-rpath,@loader_path/" + lib_dir
+            else:
+                variables["ldflags"] = "$ldflags -Wl,-rpath,\\$$ORIGIN/" + lib_dir
         executable_object = CollectionResult("bin", name, object_files,
             filename=name + self.target.executable_ext,
-            libraries=self._libs + self._deps_libraries,
-            rule="executable", variables={"linker": "$cxx"})
+            libraries=libraries,
+            rule="executable", variables=variables)
         return executable_object
 
     def plugin(self, name, object_files):
@@ -0,0 +1,681 @@
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+
+if __name__ == "__main__":
+    # The module runs as a script from the package directory, where confu.platform would shadow the standard module
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [os.path.dirname(script_dir)] + [path for path in sys.path
+        if os.path.abspath(path or os.curdir) != script_dir]
+
+import logging
+
+
+logger = logging.getLogger("confu")
+
+
+# Maximum size of the object cache, unless overridden with CONFU_OBJECT_CACHE_SIZE environment variable
+default_max_size = "5G"
+
+# Number of subdirectories in the object cache. Each subdirectory is limited to a fraction of the cache size and
+# evicted independently, so that concurrent compilations do not need a cache-wide lock.
+subdir_count = 256
+
+# Version of the cache layout and key derivation. Changing it invalidates all cached objects.
+cache_version = "1"
+
+_output_placeholder = "@CONFU_OUTPUT@"
+_build_dir_placeholder = "@CONFU_BUILD_DIR@"
+_prefix_map_flags = ("-ffile-prefix-map=", "-fdebug-prefix-map=", "-fmacro-prefix-map=")
+
+
+def is_enabled():
+    r"""Checks if the object cache is enabled by default with CONFU_OBJECT_CACHE environment variable."""
+
+    return os.getenv("CONFU_OBJECT_CACHE", "").lower() in ["1", "yes", "on", "true"]
+
+
+def get_cache_dir():
+    from confu.utils import get_cache_dir
+    return get_cache_dir("objects")
+
+
+def get_max_size():
+    from confu.validators import validate_cache_size
+    return validate_cache_size(os.getenv("CONFU_OBJECT_CACHE_SIZE", default_max_size))
+
+
+def get_command():
+    r"""Returns the command which runs this module as a compilation wrapper."""
+
+    script_path = os.path.abspath(__file__)
+    if script_path.endswith((".pyc", ".pyo")):
+        script_path = script_path[:-1]
+    return "\"{python}\" \"{script}\"".format(python=sys.executable, script=script_path)
+
+
+def get_rule_prefix(depfile=True):
+    r"""Returns a prefix for commands of ninja rules which wraps them in the object cache, if it is enabled.
+
+    :param bool depfile: whether the wrapped command generates a Makefile-style dependency file $out.d.
+    """
+
+    import confu.globals
+    if not confu.globals.object_cache:
+        return ""
+    elif depfile:
+        return "$objcache --depfile $out.d $out -- "
+    else:
+        return "$objcache $out -- "
+
+
+def _hash_file(hash, path):
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(1024 * 1024)
+            if not data:
+                break
+            hash.update(data)
+
+
+def _hash_executable(hash, name):
+    # Executables are identified by path, size and modification time: hashing compilers on every call is too slow
+    from confu.utils import find_executable
+    path = name if os.sep in name else find_executable(name)
+    if path is not None and os.path.isfile(path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        hash.update("{path}:{size}:{mtime}\0".format(path=path, size=stat.st_size, mtime=stat.st_mtime)
+            .encode("utf-8"))
+    else:
+        hash.update(name.encode("utf-8") + b"\0")
+
+
+def _find_package(name):
+    try:
+        from importlib.util import find_spec  # Python 3.4+
+        spec = find_spec(name)
+        return spec.origin if spec is not None else None
+    except ImportError:
+        import imp
+        try:
+            return imp.find_module(name)[1]
+        except ImportError:
+            return None
+
+
+def get_command_key(output, depfile, command):
+    r"""Computes a hash of the command, identity of the tools it runs, and content of the input files it lists."""
+
+    import hashlib
+    hash = hashlib.sha256()
+    hash.update(("confu-object-cache-" + cache_version + "\0").encode("utf-8"))
+
+    # Identify the compiler, and the compiler behind a launcher or a Python module (e.g. PeachPy)
+    _hash_executable(hash, command[0])
+    first_arg = 1
+    if os.path.basename(command[0]) in ["ccache", "sccache"] and len(command) > 1:
+        _hash_executable(hash, command[1])
+        first_arg = 2
+    if command[first_arg:first_arg+1] == ["-m"] and len(command) > first_arg + 1:
+        package_path = _find_package(command[first_arg + 1].split(".")[0])
+        if package_path is not None:
+            stat = os.stat(package_path)
+            hash.update("{path}:{mtime}\0".format(path=package_path, mtime=stat.st_mtime).encode("utf-8"))
+
+    for arg in command[first_arg:]:
+        if arg == output:
+            hash.update(_output_placeholder.encode("utf-8") + b"\0")
+        elif arg == depfile:
+            hash.update(_output_placeholder.encode("utf-8") + b".d\0")
+        elif arg.startswith(_prefix_map_flags):
+            # Prefix maps of relocatable builds contain the build directory, which doesn't affect the output
+            flag, _, prefix_map = arg.partition("=")
+            old_prefix, _, new_prefix = prefix_map.rpartition("=")
+            if old_prefix == os.getcwd():
+                old_prefix = _build_dir_placeholder
+            hash.update("{flag}={old}={new}\0".format(flag=flag, old=old_prefix, new=new_prefix).encode("utf-8"))
+        else:
+            hash.update(arg.encode("utf-8") + b"\0")
+            if os.path.isfile(arg):
+                _hash_file(hash, arg)
+                hash.update(b"\1")
+            elif os.path.isfile(arg + ".gch"):
+                _hash_precompiled_header(hash, arg + ".gch")
+            elif arg.startswith("-f") and os.path.isfile(arg.partition("=")[2]):
+                # Files in options, e.g. profiles in -fprofile-use=<path>
+                _hash_file(hash, arg.partition("=")[2])
+                hash.update(b"\1")
+    return hash.hexdigest()
+
+
+def _hash_precompiled_header(hash, path):
+    # Dependency files of objects don't list headers included through a precompiled header, and precompiled
+    # headers are not reproducible, so hash the headers which the precompiled header was built from
+    try:
+        with open(path + ".d") as depfile:
+            dependencies = parse_depfile(depfile.read())
+    except IOError:
+        dependencies = [path]
+    for dependency in dependencies:
+        hash.update(dependency.encode("utf-8") + b"\0")
+        if os.path.isfile(dependency):
+            _hash_file(hash, dependency)
+        hash.update(b"\1")
+
+
+def get_result_key(command_key, dependencies):
+    r"""Computes a hash of the command key and content of the files listed in the dependency file of the output.
+
+    :returns: a hex string with the hash, or None if any of the dependencies doesn't exist anymore.
+    """
+
+    import hashlib
+    hash = hashlib.sha256()
+    hash.update(command_key.encode("utf-8") + b"\0")
+    for path in dependencies:
+        if not os.path.isfile(path):
+            return None
+        hash.update(path.encode("utf-8") + b"\0")
+        _hash_file(hash, path)
+        hash.update(b"\1")
+    return hash.hexdigest()
+
+
+def parse_depfile(text):
+    r"""Parses a Makefile-style dependency file with a single target, and returns the list of prerequisites."""
+
+    text = text.replace("\\\r\n", " ").replace("\\\n", " ")
+    separator = text.find(": ")
+    if separator < 0:
+        return list()
+
+    dependencies = list()
+    path = ""
+    escaped = False
+    for char in text[separator + 2:] + " ":
+        if escaped:
+            if not char.isspace() and char != "\\":
+                path += "\\"
+            path += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char.isspace():
+            if path:
+                dependencies.append(path)
+            path = ""
+        else:
+            path += char
+    return dependencies
+
+
+def _get_entry_path(key):
+    return os.path.join(get_cache_dir(), key[:2], key)
+
+
+def _parse_stats(content):
+    try:
+        counters = list(map(int, content.split()))
+    except ValueError:
+        return [0, 0, 0]
+    # Files written before remote caching have only hits and misses
+    return (counters + [0, 0, 0])[:3]
+
+
+def _read_stats(stats_path):
+    try:
+        with open(stats_path) as stats_file:
+            return _parse_stats(stats_file.read())
+    except (IOError, OSError):
+        return [0, 0, 0]
+
+
+def _update_stats(subdir, hits=0, misses=0, remote_hits=0):
+    stats_path = os.path.join(subdir, "stats")
+    try:
+        # Compilations of a parallel build update the counters concurrently: read and rewrite them under a lock
+        with open(stats_path, "a+") as stats_file:
+            try:
+                import fcntl
+                fcntl.flock(stats_file.fileno(), fcntl.LOCK_EX)
+            except ImportError:
+                pass  # Windows: no locking
+            stats_file.seek(0)
+            old_hits, old_misses, old_remote_hits = _parse_stats(stats_file.read())
+            stats_file.seek(0)
+            stats_file.truncate()
+            stats_file.write("{hits} {misses} {remote_hits}\n".format(hits=old_hits + hits,
+                misses=old_misses + misses, remote_hits=old_remote_hits + remote_hits))
+    except (IOError, OSError):
+        pass
+
+
+def _store_file(source_path, entry_path, content=None):
+    import shutil
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix=".tmp-")
+    try:
+        if content is None:
+            with os.fdopen(fd, "wb") as entry_file, open(source_path, "rb") as source_file:
+                shutil.copyfileobj(source_file, entry_file)
+        else:
+            with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as entry_file:
+                entry_file.write(content)
+        # Cached files may be hard-linked into build directories: protect them from in-place modification
+        os.chmod(temp_path, 0o444)
+        os.rename(temp_path, entry_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def _restore_file(entry_path, path):
+    import shutil
+    if os.path.lexists(path):
+        os.remove(path)
+    try:
+        os.link(entry_path, path)
+    except OSError:
+        shutil.copyfile(entry_path, path)
+    # Refresh modification time of the cache entry: it orders entries for eviction
+    os.utime(entry_path, None)
+
+
+def evict(subdir, max_size):
+    r"""Removes least recently used entries from a subdirectory of the cache until it fits into the size limit."""
+
+    entries = list()
+    total_size = 0
+    for name in os.listdir(subdir):
+        if name == "stats" or name.startswith("."):
+            continue
+        path = os.path.join(subdir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total_size += stat.st_size
+
+    if total_size <= max_size:
+        return
+
+    # Evict down to 90% of the limit to avoid evicting on every store
+    entries.sort()
+    for mtime, size, path in entries:
+        if total_size <= max_size * 9 // 10:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+
+class RemoteCache:
+    r"""Client of a remote object cache with a simple HTTP protocol, similar to bazel-remote.
+
+    The remote cache stores content-addressed blobs at /cas/<SHA-256 of content>, and small JSON records at
+    /ac/<key>. A command key maps to a record with dependencies from the dependency file, and a result key maps to
+    a record with the SHA-256 of the output and the normalized dependency file. Blobs and records are fetched with
+    GET requests and uploaded with PUT requests.
+
+    The remote cache is configured with environment variables:
+
+     - CONFU_REMOTE_CACHE: URL of the cache server, e.g. http://cache.example.com:8080
+     - CONFU_REMOTE_CACHE_MODE: "rw" (default) to fetch and upload results, or "ro" to only fetch them
+     - CONFU_REMOTE_CACHE_TIMEOUT: timeout of network operations in seconds (default: 2)
+
+    When the server is unreachable, the remote cache is not used for the next minute (see :attr:`retry_interval`),
+    and compilations proceed without it.
+    """
+
+    # Seconds to wait before accessing an unreachable server again
+    retry_interval = 60
+
+    def __init__(self, url, writable=True, timeout=2.0):
+        self.url = url.rstrip("/")
+        self.writable = writable
+        self.timeout = timeout
+
+    @staticmethod
+    def from_env():
+        url = os.getenv("CONFU_REMOTE_CACHE")
+        if not url:
+            return None
+
+        mode = os.getenv("CONFU_REMOTE_CACHE_MODE", "rw").lower()
+        if mode not in ["ro", "rw"]:
+            raise ValueError("Invalid remote cache mode {mode}: \"ro\" or \"rw\" expected".format(mode=mode))
+        remote = RemoteCache(url, writable=mode == "rw",
+            timeout=float(os.getenv("CONFU_REMOTE_CACHE_TIMEOUT", "2")))
+        if not remote.is_available():
+            return None
+        return remote
+
+    def _get_unavailable_marker_path(self):
+        import hashlib
+        return os.path.join(get_cache_dir(),
+            ".remote-unavailable-" + hashlib.sha1(self.url.encode("utf-8")).hexdigest()[:16])
+
+    def is_available(self):
+        import time
+        try:
+            return time.time() - os.path.getmtime(self._get_unavailable_marker_path()) > self.retry_interval
+        except OSError:
+            return True
+
+    def _mark_unavailable(self, error):
+        logger.warning("remote cache {url} is unreachable, compile locally: {message}".format(
+            url=self.url, message=str(error)))
+        try:
+            _makedirs(get_cache_dir())
+            with open(self._get_unavailable_marker_path(), "w") as marker_file:
+                marker_file.write(self.url + "\n")
+        except (IOError, OSError):
+            pass
+
+    def _request(self, method, path, data=None):
+        r"""Sends a request to the cache server.
+
+        :returns: response body for GET requests, or None if the server doesn't have the requested entry.
+        """
+
+        from six.moves.urllib.request import Request, urlopen
+        from six.moves.urllib.error import HTTPError
+        request = Request(self.url + path, data=data)
+        request.get_method = lambda: method
+        if data is not None:
+            request.add_header("Content-Type", "application/octet-stream")
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            try:
+                return response.read()
+            finally:
+                response.close()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _get_record(self, key):
+        import json
+        data = self._request("GET", "/ac/" + key)
+        return json.loads(data.decode("utf-8")) if data is not None else None
+
+    def fetch(self, command_key, depfile):
+        r"""Fetches a result from the remote cache into the local cache.
+
+        :returns: True if the result was fetched, False otherwise.
+        """
+
+        import hashlib
+        from six.moves.urllib.error import HTTPError
+        try:
+            if depfile is not None:
+                manifest_path = _get_entry_path(command_key) + ".manifest"
+                if os.path.isfile(manifest_path):
+                    with open(manifest_path) as manifest_file:
+                        dependencies = manifest_file.read().splitlines()
+                else:
+                    record = self._get_record(command_key)
+                    if record is None:
+                        return False
+                    dependencies = record["dependencies"]
+                result_key = get_result_key(command_key, dependencies)
+                if result_key is None:
+                    return False
+            else:
+                result_key = command_key
+
+            record = self._get_record(result_key)
+            if record is None or (depfile is not None and record.get("depfile") is None):
+                return False
+            data = self._request("GET", "/cas/" + record["object"])
+            if data is None or hashlib.sha256(data).hexdigest() != record["object"]:
+                return False
+        except HTTPError as e:
+            logger.warning("failed to fetch from remote cache {url}: {message}".format(url=self.url, message=str(e)))
+            return False
+        except (IOError, OSError, ValueError, KeyError) as e:
+            # URLError is a subclass of IOError/OSError; socket timeouts are OSError too
+            self._mark_unavailable(e)
+            return False
+
+        result_path = _get_entry_path(result_key)
+        _makedirs(os.path.dirname(result_path))
+        if depfile is not None:
+            manifest_path = _get_entry_path(command_key) + ".manifest"
+            if not os.path.isfile(manifest_path):
+                _makedirs(os.path.dirname(manifest_path))
+                _store_file(None, manifest_path, "".join(path + "\n" for path in dependencies))
+            _store_file(None, result_path + ".d", record["depfile"])
+        _store_file(None, result_path, data)
+        return True
+
+    def upload(self, command_key, result_key, has_depfile):
+        r"""Uploads a result from the local cache to the remote cache."""
+
+        import json
+        import hashlib
+        from six.moves.urllib.error import HTTPError
+        result_path = _get_entry_path(result_key)
+        with open(result_path, "rb") as result_file:
+            data = result_file.read()
+        object_hash = hashlib.sha256(data).hexdigest()
+        record = {"object": object_hash, "depfile": None}
+        if has_depfile:
+            with open(_get_entry_path(command_key) + ".manifest") as manifest_file:
+                dependencies = manifest_file.read().splitlines()
+            with open(result_path + ".d") as depfile_file:
+                record["depfile"] = depfile_file.read()
+
+        try:
+            # Upload blobs before records which reference them
+            self._request("PUT", "/cas/" + object_hash, data)
+            self._request("PUT", "/ac/" + result_key, json.dumps(record).encode("utf-8"))
+            if has_depfile:
+                self._request("PUT", "/ac/" + command_key,
+                    json.dumps({"dependencies": dependencies}).encode("utf-8"))
+        except HTTPError as e:
+            logger.warning("failed to upload to remote cache {url}: {message}".format(url=self.url, message=str(e)))
+        except (IOError, OSError) as e:
+            self._mark_unavailable(e)
+
+    def upload_async(self, command_key, result_key, has_depfile):
+        r"""Uploads a result to the remote cache in a detached process, so that the build doesn't wait for it."""
+
+        import subprocess
+        script_path = os.path.abspath(__file__)
+        if script_path.endswith((".pyc", ".pyo")):
+            script_path = script_path[:-1]
+        args = [sys.executable, script_path, "--upload", command_key, result_key]
+        if has_depfile:
+            args.append("--depfile")
+        devnull = open(os.devnull, "r+b")
+        try:
+            # The uploader must not inherit the output pipe of the build command, or ninja would wait for it
+            kwargs = dict(stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True)
+            if sys.version_info >= (3, 2):
+                kwargs["start_new_session"] = True
+            subprocess.Popen(args, **kwargs)
+        finally:
+            devnull.close()
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Directory could be concurrently created by another compilation
+            if not os.path.isdir(path):
+                raise
+
+
+def _lookup(command_key, depfile):
+    r"""Looks up a result in the local cache.
+
+    :returns: path of the cached result, or None if it is not cached.
+    """
+
+    result_key = None
+    if depfile is None:
+        result_key = command_key
+    else:
+        manifest_path = _get_entry_path(command_key) + ".manifest"
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as manifest_file:
+                result_key = get_result_key(command_key, manifest_file.read().splitlines())
+
+    if result_key is not None:
+        result_path = _get_entry_path(result_key)
+        if os.path.isfile(result_path) and (depfile is None or os.path.isfile(result_path + ".d")):
+            return result_path
+
+
+def run(output, depfile, command):
+    r"""Runs a compilation command through the object cache.
+
+    The result is looked up in two steps. First, the command, the tools it runs, and the input files it lists
+    produce a command key. The command key maps to the list of files (e.g. headers) from the dependency file of the
+    previous compilation, and hashing their content produces the result key, which maps to the cached output and
+    dependency file. On a hit the output is hard-linked from the cache, otherwise the command is run and its output
+    is stored in the cache.
+
+    If a remote cache is configured (see :mod:`confu.cache_server`), results missing in the local cache are fetched
+    from the remote cache, and in read-write mode results of local compilations are uploaded to it in background.
+
+    :param str output: path of the output file.
+    :param str depfile: path of the dependency file generated by the command, or None.
+    :param list command: the compilation command.
+    :returns: exit code of the command.
+    """
+
+    import subprocess
+    output = os.path.abspath(output)
+    if depfile is not None:
+        depfile = os.path.abspath(depfile)
+    remote = RemoteCache.from_env()
+    try:
+        command_key = get_command_key(output, depfile, command)
+        subdir = os.path.dirname(_get_entry_path(command_key))
+        result_path = _lookup(command_key, depfile)
+        remote_hit = False
+        if result_path is None and remote is not None:
+            remote_hit = remote.fetch(command_key, depfile)
+            if remote_hit:
+                result_path = _lookup(command_key, depfile)
+
+        if result_path is not None:
+            _restore_file(result_path, output)
+            if depfile is not None:
+                with open(result_path + ".d") as cached_depfile:
+                    depfile_text = cached_depfile.read()
+                with open(depfile, "w") as depfile_file:
+                    depfile_file.write(depfile_text.replace(_output_placeholder, output))
+            _update_stats(subdir, hits=1, remote_hits=int(remote_hit))
+            return 0
+    except (IOError, OSError) as e:
+        logger.warning("failed to look up {output} in the object cache: {message}".format(
+            output=output, message=str(e)))
+        command_key = None
+
+    # Outputs may be hard links to cached files, and compilers would overwrite them in place
+    if os.path.lexists(output):
+        os.remove(output)
+    returncode = subprocess.call(command)
+    if returncode != 0 or command_key is None:
+        return returncode
+
+    try:
+        _makedirs(subdir)
+        if depfile is not None:
+            with open(depfile) as depfile_file:
+                depfile_text = depfile_file.read()
+            dependencies = parse_depfile(depfile_text)
+            result_key = get_result_key(command_key, dependencies)
+            if result_key is None:
+                return returncode
+            _store_file(None, _get_entry_path(command_key) + ".manifest",
+                "".join(path + "\n" for path in dependencies))
+        else:
+            result_key = command_key
+
+        result_path = _get_entry_path(result_key)
+        result_subdir = os.path.dirname(result_path)
+        _makedirs(result_subdir)
+        if depfile is not None:
+            _store_file(None, result_path + ".d", depfile_text.replace(output, _output_placeholder))
+        _store_file(output, result_path)
+        _update_stats(subdir, misses=1)
+
+        if remote is not None and remote.writable:
+            remote.upload_async(command_key, result_key, depfile is not None)
+
+        max_subdir_size = get_max_size() // subdir_count
+        evict(subdir, max_subdir_size)
+        if result_subdir != subdir:
+            evict(result_subdir, max_subdir_size)
+    except (IOError, OSError) as e:
+        logger.warning("failed to store {output} in the object cache: {message}".format(
+            output=output, message=str(e)))
+    return returncode
+
+
+def get_statistics():
+    r"""Collects statistics of the object cache.
+
+    :returns: a dictionary with the number of hits (including hits in the remote cache), misses, cached files, and
+              their total size in bytes.
+    """
+
+    statistics = dict(hits=0, misses=0, remote_hits=0, files=0, size=0)
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return statistics
+
+    for subdir_name in os.listdir(cache_dir):
+        subdir = os.path.join(cache_dir, subdir_name)
+        if not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            path = os.path.join(subdir, name)
+            if name == "stats":
+                hits, misses, remote_hits = _read_stats(path)
+                statistics["hits"] += hits
+                statistics["misses"] += misses
+                statistics["remote_hits"] += remote_hits
+            elif not name.startswith("."):
+                statistics["files"] += 1
+                statistics["size"] += os.path.getsize(path)
+    return statistics
+
+
+def main(args):
+    if args[:1] == ["--upload"] and len(args) in [3, 4]:
+        remote = RemoteCache.from_env()
+        if remote is not None:
+            remote.upload(args[1], args[2], args[3:] == ["--depfile"])
+        return 0
+
+    depfile = None
+    if "--" not in args:
+        print("usage: cache.py [--depfile DEPFILE] OUTPUT -- COMMAND...", file=sys.stderr)
+        return 2
+
+    separator = args.index("--")
+    options, command = args[:separator], args[separator+1:]
+    if options[:1] == ["--depfile"]:
+        depfile, options = options[1], options[2:]
+    if len(options) != 1 or not command:
+        print("usage: cache.py [--depfile DEPFILE] OUTPUT -- COMMAND...", file=sys.stderr)
+        return 2
+
+    return run(options[0], depfile, command)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,238 @@
+from __future__ import absolute_import
+
+import os
+import sys
+import logging
+import threading
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+
+logger = logging.getLogger("confu")
+
+
+# Maximum size of a single uploaded entry
+max_entry_size = 1024**3
+
+
+class CacheStorage:
+    r"""On-disk storage of a remote object cache server.
+
+    Entries are stored in <root>/ac/<key[:2]>/<key> (records) and <root>/cas/<key[:2]>/<key> (content-addressed
+    blobs). When the total size exceeds the limit, least recently used entries are evicted.
+    """
+
+    def __init__(self, root_dir, max_size=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.size = 0
+        for namespace in ["ac", "cas"]:
+            namespace_dir = os.path.join(self.root_dir, namespace)
+            if not os.path.isdir(namespace_dir):
+                os.makedirs(namespace_dir)
+            for path, size, _ in self._iter_entries(namespace_dir):
+                self.size += size
+
+    @staticmethod
+    def _iter_entries(namespace_dir):
+        for subdir_name in os.listdir(namespace_dir):
+            subdir = os.path.join(namespace_dir, subdir_name)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def get_path(self, namespace, key):
+        return os.path.join(self.root_dir, namespace, key[:2], key)
+
+    def get(self, namespace, key):
+        path = self.get_path(namespace, key)
+        try:
+            with open(path, "rb") as entry_file:
+                data = entry_file.read()
+        except (IOError, OSError):
+            return None
+        try:
+            # Modification time orders entries for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, namespace, key, data):
+        import tempfile
+        path = self.get_path(namespace, key)
+        subdir = os.path.dirname(path)
+        with self.lock:
+            if not os.path.isdir(subdir):
+                os.makedirs(subdir)
+            old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            fd, temp_path = tempfile.mkstemp(dir=subdir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as entry_file:
+                entry_file.write(data)
+            os.rename(temp_path, path)
+            self.size += len(data) - old_size
+            if self.max_size is not None and self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = list()
+        for namespace in ["ac", "cas"]:
+            entries += [(mtime, size, path) for path, size, mtime in
+                        self._iter_entries(os.path.join(self.root_dir, namespace))]
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the limit to avoid evicting on every upload
+        for mtime, size, path in entries:
+            if self.size <= self.max_size * 9 // 10:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+        logger.info("evicted cache entries, {size:.1f} MB left".format(size=self.size / 1048576.0))
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    r"""Handles GET, HEAD and PUT requests for /ac/<key> and /cas/<SHA-256> paths."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _parse_path(self):
+        import re
+        match = re.match(r"^/(ac|cas)/([0-9a-f]{64})$", self.path.split("?", 1)[0])
+        if match is None:
+            self._send_status(400, "Invalid cache path: /ac/<key> or /cas/<sha256> expected")
+            return None, None
+        return match.group(1), match.group(2)
+
+    def _send_status(self, code, message=""):
+        body = (message + "\n").encode("utf-8") if message else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_entry(self, include_body):
+        namespace, key = self._parse_path()
+        if namespace is None:
+            return
+        data = self.server.storage.get(namespace, key)
+        if data is None:
+            self._send_status(404, "Not found")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._send_entry(include_body=True)
+
+    def do_HEAD(self):
+        self._send_entry(include_body=False)
+
+    def do_PUT(self):
+        if self.server.read_only:
+            self._send_status(403, "The cache is read-only")
+            return
+        namespace, key = self._parse_path()
+        if namespace is None:
+            return
+        try:
+            length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self._send_status(411, "Content-Length required")
+            return
+        if length < 0 or length > max_entry_size:
+            self._send_status(413, "Entry is too large")
+            return
+
+        data = self.rfile.read(length)
+        if namespace == "cas":
+            import hashlib
+            if hashlib.sha256(data).hexdigest() != key:
+                self._send_status(400, "Content doesn't match its SHA-256 hash")
+                return
+        self.server.storage.put(namespace, key, data)
+        self._send_status(200)
+
+    def log_message(self, format, *args):
+        logger.debug("{client} {message}".format(client=self.address_string(), message=format % args))
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, storage, read_only=False):
+        HTTPServer.__init__(self, address, CacheRequestHandler)
+        self.storage = storage
+        self.read_only = read_only
+
+
+def serve(root_dir, host="127.0.0.1", port=8080, max_size=None, read_only=False):
+    r"""Runs a remote object cache server.
+
+    Clients use it by setting CONFU_REMOTE_CACHE=http://<host>:<port> environment variable for builds configured with
+    --object-cache (see :class:`confu.cache.RemoteCache`).
+
+    :param str root_dir: directory to store cache entries in.
+    :param int max_size: maximum total size of cache entries in bytes, or None for unlimited size.
+    :param bool read_only: if True, reject uploads.
+    """
+
+    storage = CacheStorage(root_dir, max_size)
+    server = CacheServer((host, port), storage, read_only)
+    logger.info("serve object cache {path} ({size:.1f} MB) on http://{host}:{port}".format(
+        path=storage.root_dir, size=storage.size / 1048576.0, host=host, port=server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_arguments(parser):
+    from confu.utils import get_cache_dir
+    parser.add_argument("--dir", dest="dir", default=get_cache_dir("server"),
+        help="directory to store cache entries in (default: {path})".format(path=get_cache_dir("server")))
+    parser.add_argument("--host", dest="host", default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", dest="port", type=int, default=8080,
+        help="port to listen on (default: 8080)")
+    parser.add_argument("--max-size", dest="max_size", metavar="SIZE",
+        help="evict least recently used entries when the cache exceeds SIZE (e.g. 100G)")
+    parser.add_argument("--read-only", dest="read_only", action="store_true",
+        help="reject uploads")
+
+
+def run_server(options):
+    from confu.validators import validate_cache_size
+    max_size = validate_cache_size(options.max_size) if options.max_size is not None else None
+    serve(options.dir, options.host, options.port, max_size, options.read_only)
+
+
+def main(args):
+    import argparse
+    parser = argparse.ArgumentParser(description="Confu remote object cache server")
+    add_arguments(parser)
+    run_server(parser.parse_args(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
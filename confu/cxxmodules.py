@@ -0,0 +1,179 @@
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+
+if __name__ == "__main__":
+    # The module runs as a script from the package directory, where confu.platform would shadow the standard module
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [os.path.dirname(script_dir)] + [path for path in sys.path
+        if os.path.abspath(path or os.curdir) != script_dir]
+
+import logging
+
+
+logger = logging.getLogger("confu")
+
+
+# Path of the ninja dyndep file with dependencies between C++ modules, relative to the build directory
+dyndep_filename = "cxx-modules.dd"
+
+
+def get_command():
+    r"""Returns the command which runs this module as a collator of module dependencies."""
+
+    script_path = os.path.abspath(__file__)
+    if script_path.endswith((".pyc", ".pyo")):
+        script_path = script_path[:-1]
+    return "\"{python}\" \"{script}\"".format(python=sys.executable, script=script_path)
+
+
+def generate_collation(ninja, scan_paths):
+    r"""Generates the build edge which collates module dependencies of the scanned C++ sources."""
+
+    import confu.globals
+    from confu.utils import get_build_path, get_output_dir
+    build_dir = get_output_dir("build")
+    ninja.build(get_build_path(os.path.join(build_dir, dyndep_filename)), "cxx_collate", scan_paths,
+        implicit_outputs=[get_modmap_path(scan_path[:-len(".ddi")]) for scan_path in scan_paths],
+        variables={"bmidir": get_build_path(os.path.join(build_dir, "bmi"))})
+
+
+def get_scan_path(object_path):
+    return object_path + ".ddi"
+
+
+def get_modmap_path(object_path):
+    return object_path + ".modmap"
+
+
+def get_modmap_flags(object_path, flavor):
+    r"""Returns compiler flags which make a compilation read mapping of module names to BMI files from the
+    module map file of the object."""
+
+    if flavor == "gcc":
+        # Dependencies on BMIs come from the dyndep file; gcc would list them as make rules which ninja can't parse
+        return "-fmodules-ts -fmodule-mapper=" + get_modmap_path(object_path) + " -Mno-modules"
+    else:
+        return "@" + get_modmap_path(object_path)
+
+
+def get_bmi_path(bmi_dir, module_name, flavor):
+    # Partitions are named module:partition, but colons are not valid in file names on Windows
+    return os.path.join(bmi_dir, module_name.replace(":", "-")) + (".gcm" if flavor == "gcc" else ".pcm")
+
+
+def load_scan(path):
+    r"""Loads a P1689 dependency scan of a source file.
+
+    :returns: a tuple of the list of module names provided by the source and the list of module names it imports.
+    """
+
+    import json
+    with open(path) as scan_file:
+        scan = json.load(scan_file)
+
+    provides, requires = list(), list()
+    for rule in scan.get("rules", list()):
+        provides += [module["logical-name"] for module in rule.get("provides", list())]
+        for module in rule.get("requires", list()):
+            if "lookup-method" in module:
+                raise ValueError("{path}: header unit {name} is not supported; use #include instead of import"
+                                 .format(path=path, name=module["logical-name"]))
+            requires.append(module["logical-name"])
+    return provides, requires
+
+
+def collate(scan_paths, dyndep_path, bmi_dir, flavor):
+    r"""Resolves imports of C++ modules between scanned sources.
+
+    Writes a ninja dyndep file, which adds BMI files of provided modules as outputs of compilations and BMIs of
+    imported modules as their inputs, and a module map file for every source. The files are rewritten only if their
+    content changes.
+
+    :param list scan_paths: paths to P1689 scans of sources. Each scan is named <object>.ddi.
+    :param str dyndep_path: path of the dyndep file to write.
+    :param str bmi_dir: directory for BMI files.
+    :param str flavor: "gcc" or "clang", the format of module map files.
+    """
+
+    provided_by = dict()
+    requirements = dict()
+    bmi_outputs = dict()
+    for scan_path in scan_paths:
+        object_path = scan_path[:-len(".ddi")]
+        provides, requires = load_scan(scan_path)
+        for module_name in provides:
+            if module_name in provided_by:
+                raise ValueError("module {name} is provided by both {first} and {second}".format(
+                    name=module_name, first=provided_by[module_name], second=object_path))
+            provided_by[module_name] = object_path
+        requirements[object_path] = requires
+        bmi_outputs[object_path] = [get_bmi_path(bmi_dir, module_name, flavor) for module_name in provides]
+
+    for object_path, requires in requirements.items():
+        for module_name in requires:
+            if module_name not in provided_by:
+                raise ValueError("module {name} imported in {object} is not provided by any source".format(
+                    name=module_name, object=object_path))
+
+    def transitive_requirements(object_path, visited):
+        for module_name in requirements[object_path]:
+            if module_name not in visited:
+                visited.add(module_name)
+                transitive_requirements(provided_by[module_name], visited)
+        return visited
+
+    from confu.utils import write_if_changed
+    dyndep_lines = ["ninja_dyndep_version = 1"]
+    for object_path in sorted(requirements):
+        # clang needs BMIs of all transitively imported modules, gcc finds them through the module mapper
+        required_modules = sorted(transitive_requirements(object_path, set()))
+        provided_modules = [module_name for module_name, provider in provided_by.items() if provider == object_path]
+        if flavor == "gcc":
+            modmap = "".join("{name} {path}\n".format(name=module_name,
+                                                      path=get_bmi_path(bmi_dir, module_name, flavor))
+                             for module_name in provided_modules + required_modules)
+        else:
+            modmap = "".join("-x c++-module\n-fmodule-output={path}\n".format(
+                                 path=get_bmi_path(bmi_dir, module_name, flavor))
+                             for module_name in provided_modules)
+            modmap += "".join("-fmodule-file={name}={path}\n".format(name=module_name,
+                                                                     path=get_bmi_path(bmi_dir, module_name, flavor))
+                              for module_name in required_modules)
+        write_if_changed(get_modmap_path(object_path), modmap)
+
+        required_bmis = [get_bmi_path(bmi_dir, module_name, flavor) for module_name in required_modules]
+        dyndep_lines.append("build {object}{outputs}: dyndep{inputs}".format(
+            object=_escape(object_path),
+            outputs=" | " + " ".join(map(_escape, bmi_outputs[object_path])) if bmi_outputs[object_path] else "",
+            inputs=" | " + " ".join(map(_escape, required_bmis)) if required_bmis else ""))
+
+    if not os.path.isdir(bmi_dir):
+        os.makedirs(bmi_dir)
+    write_if_changed(dyndep_path, "\n".join(dyndep_lines) + "\n")
+
+
+def _escape(path):
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def main(args):
+    import argparse
+    parser = argparse.ArgumentParser(description="Collator of C++ module dependencies")
+    parser.add_argument("--flavor", dest="flavor", choices=["gcc", "clang"], required=True)
+    parser.add_argument("--bmi-dir", dest="bmi_dir", required=True)
+    parser.add_argument("--dyndep", dest="dyndep", required=True)
+    parser.add_argument("scans", nargs="*")
+    options = parser.parse_args(args)
+
+    try:
+        collate(options.scans, options.dyndep, options.bmi_dir, options.flavor)
+    except (IOError, ValueError) as e:
+        print("error: " + str(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,19 +1,35 @@
 import logging
 logger = logging.getLogger("confu")
 
-try:
-    import pygit2
-    if not(pygit2.features & pygit2.GIT_FEATURE_HTTPS) or not(pygit2.features & pygit2.GIT_FEATURE_SSH):
-        logger.warning("pygit2 is built without HTTPS or SSH support, fall back to using git executable")
-        pygit2 = None
-except ImportError:
-    pygit2 = None
+failed_certificate_hosts = set()
 
+_pygit2 = None
+_pygit2_loaded = False
 
-failed_certificate_hosts = set()
 
+def get_pygit2():
+    r"""Imports pygit2 on first use.
+
+    :returns: pygit2 module, or None if pygit2 is not installed or lacks HTTPS or SSH support.
+    """
+
+    global _pygit2, _pygit2_loaded
+    if not _pygit2_loaded:
+        _pygit2_loaded = True
+        try:
+            import pygit2
+            if not(pygit2.features & pygit2.GIT_FEATURE_HTTPS) or not(pygit2.features & pygit2.GIT_FEATURE_SSH):
+                logger.warning("pygit2 is built without HTTPS or SSH support, fall back to using git executable")
+            else:
+                _pygit2 = pygit2
+        except ImportError:
+            pass
+    return _pygit2
+
+
+def _create_remote_callbacks():
+    pygit2 = get_pygit2()
 
-if pygit2 is not None:
     class RemoteCallbacks(pygit2.RemoteCallbacks):
         def __init__(self, credentials=None, certificate=None):
             super(RemoteCallbacks, self).__init__(credentials, certificate)
@@ -26,45 +42,296 @@ if pygit2 is not None:
                     failed_certificate_hosts.add(host)
 
             return True
-else:
-    class Repo:
-        def __init__(self, root_dir):
-            self.root_dir = root_dir
-
-        @staticmethod
-        def clone(url, path, checkout_branch=None):
-            import subprocess
-            args = ["git", "clone", "--quiet", url]
+
+    return RemoteCallbacks()
+
+
+class Repo:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    @staticmethod
+    def _git(args, cwd=None, check=True):
+        import subprocess
+        import os
+        env = os.environ.copy()
+        env["LC_ALL"] = "C"
+
+        git = subprocess.Popen(["git"] + args, cwd=cwd, env=env, stdout=subprocess.PIPE)
+        output, _ = git.communicate()
+        assert not check or git.returncode == 0
+
+        if check:
+            return output.decode("utf-8")
+        else:
+            return git.returncode, output.decode("utf-8")
+
+    @staticmethod
+    def clone(url, path, checkout_branch=None, ref=None, depth=None, sparse=None, shared=False):
+        if ref is None and depth is None and not sparse:
+            args = ["clone", "--quiet", url]
+            if shared:
+                args.append("--shared")
             if checkout_branch is not None:
                 args += ["-b", checkout_branch]
             args.append(path)
+            Repo._git(args)
+            return Repo(path)
+
+        # Fetch only the requested ref (commit, tag, or branch) into an empty repository
+        if ref is None:
+            ref = checkout_branch if checkout_branch is not None else "HEAD"
 
+        Repo._git(["init", "--quiet", path])
+        repo = Repo(path)
+        repo._git(["remote", "add", "origin", url], cwd=path)
+        if shared:
+            # Use objects of the local repository at url through alternates instead of copying them
             import os
-            env = os.environ.copy()
-            env["LC_ALL"] = "C"
+            with open(os.path.join(path, ".git", "objects", "info", "alternates"), "w") as alternates:
+                alternates.write(os.path.join(os.path.abspath(url), "objects") + "\n")
+        fetch_args = ["fetch", "--quiet"]
+        if depth is not None:
+            fetch_args += ["--depth", str(depth)]
+        if sparse:
+            # Partial clone: blobs outside of the sparse checkout are never downloaded (if the server supports it)
+            repo._git(["config", "remote.origin.promisor", "true"], cwd=path)
+            repo._git(["config", "remote.origin.partialclonefilter", "blob:none"], cwd=path)
+            repo._git(["sparse-checkout", "set", "--cone"] + list(sparse), cwd=path)
+            fetch_args.append("--filter=blob:none")
+        repo._git(fetch_args + ["origin", ref], cwd=path)
+        repo.checkout("FETCH_HEAD")
+        return repo
 
-            git = subprocess.Popen(args, env=env)
-            git.communicate()
-            assert git.returncode == 0
+    def checkout(self, refname):
+        self._git(["checkout", "--quiet", refname], cwd=self.root_dir)
 
-            return Repo(path)
 
-        def checkout(self, refname):
-            import subprocess
-            args = ["git", "checkout", "--quiet", refname]
+def is_cache_enabled():
+    import os
+    if os.getenv("CONFU_GIT_CACHE", "1").lower() in ["0", "no", "off", "false"]:
+        return False
 
-            import os
-            env = os.environ.copy()
-            env["LC_ALL"] = "C"
+    from confu.utils import find_executable
+    return find_executable("git") is not None
+
+
+def get_mirror_dir(url):
+    import os
+    import hashlib
+    from confu.utils import get_cache_dir
+    name = url.rstrip("/").rsplit("/", 1)[-1]
+    if name.endswith(".git"):
+        name = name[:-len(".git")]
+    return get_cache_dir("git", name + "-" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:16] + ".git")
+
+
+def _is_commit_hash(ref):
+    import re
+    return re.match(r"^[0-9a-fA-F]{40}$", ref) is not None
+
+
+def update_mirror(url, ref=None, offline=False):
+    r"""Creates or updates a bare mirror of a git repository in the user-level git cache.
+
+    Tags and commits which are already in the mirror are never fetched again, so warm mirrors don't need network
+    access. Branches are fetched again, but if the fetch fails, the mirror falls back to the previously fetched commit.
+    Mirrors are shared by all clones of the URL, so they always have full history; shallow clones are made from them.
+
+    :param bool offline: if True, never access the network, and fail if the ref is not in the mirror.
+    :returns: a tuple of the mirror directory and the name of the mirrored ref in it (None for a full mirror).
+    """
+
+    import os
+    import time
+    mirror_dir = get_mirror_dir(url)
+    if not os.path.isdir(mirror_dir):
+        import tempfile
+        cache_dir = os.path.dirname(mirror_dir)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+        Repo._git(["init", "--quiet", "--bare", temp_dir])
+        Repo._git(["remote", "add", "origin", url], cwd=temp_dir)
+        Repo._git(["config", "--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"], cwd=temp_dir)
+        Repo._git(["config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*"], cwd=temp_dir)
+        try:
+            os.rename(temp_dir, mirror_dir)
+        except OSError:
+            # Concurrently created by another process
+            import shutil
+            shutil.rmtree(temp_dir)
+
+    # Modification time of this file orders mirrors for least-recently-used eviction
+    with open(os.path.join(mirror_dir, "confu-last-used"), "w") as last_used_file:
+        last_used_file.write(str(int(time.time())) + "\n")
+
+    fetch_args = ["fetch", "--quiet"]
+    if os.path.isfile(os.path.join(mirror_dir, "shallow")):
+        # Mirrors created by older versions could be shallow
+        fetch_args.append("--unshallow")
+    if ref is None:
+        mirror_ref = None
+        cached = Repo._git(["rev-parse", "--verify", "--quiet", "HEAD^{commit}"], cwd=mirror_dir, check=False)[0] == 0
+        fetch_args.append("origin")
+    else:
+        mirror_ref = ref if ref.startswith("refs/") else "refs/confu/" + ref
+        cached = Repo._git(["rev-parse", "--verify", "--quiet", mirror_ref + "^{commit}"],
+            cwd=mirror_dir, check=False)[0] == 0
+        if not cached and _is_commit_hash(ref) and \
+                Repo._git(["cat-file", "-e", ref + "^{commit}"], cwd=mirror_dir, check=False)[0] == 0:
+            # The commit was fetched through another ref, e.g. a tag or a branch
+            Repo._git(["update-ref", mirror_ref, ref], cwd=mirror_dir)
+            cached = True
+        if cached and (offline or ref.startswith("refs/tags/") or _is_commit_hash(ref)):
+            logger.debug("use cached {ref} from git mirror {path}".format(ref=ref, path=mirror_dir))
+            return mirror_dir, mirror_ref
+        fetch_args += ["origin", "+" + ref + ":" + mirror_ref]
 
-            git = subprocess.Popen(args, cwd=self.root_dir, env=env)
-            git.communicate()
-            assert git.returncode == 0
+    if offline:
+        if cached:
+            return mirror_dir, mirror_ref
+        raise EnvironmentError("{ref} of {url} is not available offline in git mirror {path}".format(
+            ref=ref or "HEAD", url=url, path=mirror_dir))
 
+    if Repo._git(fetch_args, cwd=mirror_dir, check=False)[0] != 0:
+        if cached:
+            logger.warning("failed to update git mirror of {url}, use previously fetched version".format(url=url))
+        else:
+            raise EnvironmentError("Failed to fetch {url} into git mirror {path}".format(url=url, path=mirror_dir))
+    elif ref is None:
+        # Mirror the default branch of the remote repository
+        returncode, output = Repo._git(["ls-remote", "--symref", "origin", "HEAD"], cwd=mirror_dir, check=False)
+        if returncode == 0 and output.startswith("ref: "):
+            Repo._git(["symbolic-ref", "HEAD", output[len("ref: "):].split()[0]], cwd=mirror_dir)
 
-def clone(url, path, checkout_branch=None):
+    return mirror_dir, mirror_ref
+
+
+def _register_mirror_dependent(mirror_dir, path):
+    import os
+    with open(os.path.join(mirror_dir, "confu-dependents"), "a") as dependents_file:
+        dependents_file.write(os.path.abspath(path) + "\n")
+
+
+def list_mirrors():
+    r"""Lists mirrors in the user-level git cache.
+
+    :returns: a list of (mirror directory, url, size in bytes, last use time) tuples, least recently used first.
+    """
+
+    import os
+    from confu.utils import get_cache_dir, get_directory_size
+    cache_dir = get_cache_dir("git")
+    mirrors = list()
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            mirror_dir = os.path.join(cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(mirror_dir):
+                continue
+
+            last_used_path = os.path.join(mirror_dir, "confu-last-used")
+            last_used = os.path.getmtime(last_used_path if os.path.isfile(last_used_path) else mirror_dir)
+            returncode, url = Repo._git(["config", "remote.origin.url"], cwd=mirror_dir, check=False)
+            mirrors.append((mirror_dir, url.strip(), get_directory_size(mirror_dir), last_used))
+    mirrors.sort(key=lambda mirror: mirror[3])
+    return mirrors
+
+
+def evict_mirror(mirror_dir):
+    r"""Removes a mirror from the user-level git cache.
+
+    Repositories which borrow objects from the mirror through alternates are repacked to include all their objects
+    before the mirror is removed.
+    """
+
+    import os
+    import shutil
+    dependents_path = os.path.join(mirror_dir, "confu-dependents")
+    if os.path.isfile(dependents_path):
+        with open(dependents_path) as dependents_file:
+            dependents = set(line.strip() for line in dependents_file if line.strip())
+        mirror_objects_dir = os.path.join(mirror_dir, "objects")
+        for dependent in sorted(dependents):
+            alternates_path = os.path.join(dependent, ".git", "objects", "info", "alternates")
+            if not os.path.isfile(alternates_path):
+                continue
+            with open(alternates_path) as alternates_file:
+                alternates = [line.strip() for line in alternates_file if line.strip()]
+            if mirror_objects_dir not in alternates:
+                continue
+
+            logger.info("dissociate {path} from git mirror {mirror}".format(path=dependent, mirror=mirror_dir))
+            Repo._git(["repack", "-a", "-d", "-q"], cwd=dependent)
+            alternates.remove(mirror_objects_dir)
+            if alternates:
+                with open(alternates_path, "w") as alternates_file:
+                    alternates_file.write("".join(alternate + "\n" for alternate in alternates))
+            else:
+                os.remove(alternates_path)
+    shutil.rmtree(mirror_dir)
+
+
+def get_commit(path):
+    r"""Returns the hash of the commit checked out in a git repository."""
+
+    pygit2 = get_pygit2()
     if pygit2 is not None:
-        remote_callbacks = RemoteCallbacks()
-        return pygit2.clone_repository(url, path, checkout_branch=checkout_branch, callbacks=remote_callbacks)
+        return str(pygit2.Repository(path).head.target)
+    else:
+        return Repo._git(["rev-parse", "HEAD"], cwd=path).strip()
+
+
+def fetch(url, path, ref=None, depth=None):
+    r"""Fetches a ref into an existing clone of a git repository and checks it out.
+
+    :param str url: URL of the repository.
+    :param str path: directory with an existing clone of the repository.
+    :param str ref: commit, tag, or branch to fetch and check out.
+    :param int depth: number of commits to fetch from the history of the checked out ref.
+    """
+
+    if is_cache_enabled():
+        source, source_ref = update_mirror(url, ref=ref)
+        if source_ref is None:
+            source_ref = "HEAD"
+    else:
+        source, source_ref = url, ref or "HEAD"
+
+    fetch_args = ["fetch", "--quiet"]
+    if depth is not None:
+        fetch_args += ["--depth", str(depth)]
+    Repo._git(fetch_args + [source, source_ref], cwd=path)
+    Repo(path).checkout("FETCH_HEAD")
+
+
+def clone(url, path, checkout_branch=None, ref=None, depth=None, sparse=None, offline=False):
+    r"""Clones a git repository.
+
+    Unless disabled with CONFU_GIT_CACHE=0 environment variable, the repository is first mirrored in the user-level
+    git cache (see :func:`update_mirror`), and then cloned from the mirror, borrowing its objects through alternates.
+
+    :param str url: URL of the repository.
+    :param str path: directory to clone the repository into.
+    :param str checkout_branch: branch to check out after a full clone.
+    :param str ref: commit, tag, or branch to fetch and check out. If specified, other refs are not fetched.
+    :param int depth: number of commits to fetch from the history of the checked out ref.
+    :param list sparse: subdirectories to check out. Files in the root directory are always checked out.
+    :param bool offline: if True, clone only from the git cache, and fail if the ref is not cached.
+    """
+
+    if offline and not is_cache_enabled():
+        raise EnvironmentError("Can not clone {url} offline: git cache is disabled".format(url=url))
+
+    if is_cache_enabled():
+        mirror_dir, mirror_ref = update_mirror(url, ref=ref, offline=offline)
+        repo = Repo.clone(mirror_dir, path, checkout_branch=checkout_branch,
+            ref=mirror_ref, depth=depth, sparse=sparse, shared=True)
+        repo._git(["remote", "set-url", "origin", url], cwd=path)
+        _register_mirror_dependent(mirror_dir, path)
+        return repo
+    elif get_pygit2() is not None and ref is None and depth is None and not sparse:
+        remote_callbacks = _create_remote_callbacks()
+        return get_pygit2().clone_repository(url, path, checkout_branch=checkout_branch, callbacks=remote_callbacks)
     else:
-        return Repo.clone(url, path, checkout_branch=checkout_branch)
+        return Repo.clone(url, path, checkout_branch=checkout_branch, ref=ref, depth=depth, sparse=sparse)
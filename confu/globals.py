@@ -1,4 +1,30 @@
 root_dir = None
 build_ninja_path = None
+dependency_args = None
+object_cache = False
+relocatable = False
+# Build profile ("debug", "release", "relwithdebinfo", or "custom"), or None for the default flags and directories
+profile = None
+# Number of sources in a unity translation unit, or 0 if unity builds are disabled
+unity = 0
+# Mode of profile-guided optimization ("generate" or "use"), or None if disabled
+pgo = None
+# Extra inputs of all compilations, e.g. the profile for profile-guided optimization
+compile_deps = list()
+# Depths of ninja pools for links and for compilations of sources marked as heavy
+link_jobs = 1
+heavy_jobs = 1
+# Mode of C++ modules support ("named" or "clang"), or None if disabled
+cxx_modules = None
+# Files which configuration writes besides build.ninja, e.g. unity sources. They are outputs of the configure edge,
+# so that ninja re-runs configuration if they are missing
+configure_outputs = list()
+# Dependency scans of C++ sources for collation of named modules
+cxx_module_scans = list()
 deps = dict()
 tools = dict()
+
+# Per-configure cache of directory listings: directory path -> {entry name: (True if file, True if directory)}
+stat_cache = dict()
+stat_cache_hits = 0
+stat_cache_misses = 0
@@ -1,16 +1,117 @@
 import os
 import logging
 
+import six
+
 
 logger = logging.getLogger("confu")
 
 
+# Maximum number of parsed manifests in the user-level manifest cache
+max_cached_manifests = 4096
+
+# Parsed manifests in this process: path -> ((mtime, size), Project)
+_projects = dict()
+
+# Parsed manifests persisted across processes: path -> ((mtime, size), parsed YAML, last use time)
+_manifest_cache = None
+_manifest_cache_dirty = False
+
+
+def load_yaml(text):
+    r"""Parses YAML text using libyaml-based CSafeLoader if available, and pure-Python SafeLoader otherwise."""
+
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+
+def get_manifest_cache_path():
+    from confu.utils import get_cache_dir
+    return get_cache_dir("manifests.pickle")
+
+
+def _get_manifest_cache():
+    global _manifest_cache
+    if _manifest_cache is None:
+        _manifest_cache = dict()
+        cache_path = get_manifest_cache_path()
+        if os.path.isfile(cache_path):
+            from six.moves import cPickle as pickle
+            try:
+                with open(cache_path, "rb") as cache_file:
+                    _manifest_cache = pickle.load(cache_file)
+            except Exception as e:
+                logger.warning("failed to load manifest cache {path}: {message}".format(
+                    path=cache_path, message=str(e)))
+    return _manifest_cache
+
+
+def _update_manifest_cache(manifest_path, key, manifest_yaml):
+    global _manifest_cache_dirty
+    import time
+    _get_manifest_cache()[manifest_path] = (key, manifest_yaml, time.time())
+    if not _manifest_cache_dirty:
+        _manifest_cache_dirty = True
+        import atexit
+        atexit.register(_save_manifest_cache)
+
+
+def _save_manifest_cache():
+    global _manifest_cache_dirty
+    _manifest_cache_dirty = False
+
+    entries = sorted(six.iteritems(_manifest_cache), key=lambda entry: entry[1][2], reverse=True)
+    manifest_cache = dict(entries[:max_cached_manifests])
+
+    import tempfile
+    from six.moves import cPickle as pickle
+    cache_path = get_manifest_cache_path()
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".manifests-")
+        with os.fdopen(fd, "wb") as cache_file:
+            pickle.dump(manifest_cache, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError) as e:
+        logger.warning("failed to save manifest cache {path}: {message}".format(
+            path=cache_path, message=str(e)))
+
+
 class Dependency:
     def __init__(self, yaml_dict):
         self.name = yaml_dict["name"]
         self.url = yaml_dict.get("url")
         self.dir = yaml_dict.get("dir")
 
+        # Options for git dependencies: check out only the specified commit, tag, or branch, with the specified
+        # depth of history, and only the listed subdirectories
+        self.ref = yaml_dict.get("ref")
+        self.depth = yaml_dict.get("depth")
+        if self.depth is not None:
+            self.depth = int(self.depth)
+            if self.depth <= 0:
+                raise ValueError("Invalid depth {depth} of dependency {name}: a positive number expected"
+                    .format(depth=self.depth, name=self.name))
+        self.sparse = yaml_dict.get("sparse")
+        if isinstance(self.sparse, str):
+            self.sparse = [self.sparse]
+
+        # Archive dependencies: a tarball or zip archive with a SHA-256 checksum of the archive file
+        self.archive = yaml_dict.get("archive")
+        self.sha256 = yaml_dict.get("sha256")
+        if self.archive is not None:
+            if self.url is not None:
+                raise ValueError("Dependency {name} can not specify both url and archive".format(name=self.name))
+            if self.sha256 is None:
+                raise ValueError("Archive dependency {name} must specify sha256 checksum".format(name=self.name))
+            import re
+            if re.match(r"^[0-9a-fA-F]{64}$", str(self.sha256)) is None:
+                raise ValueError("Invalid sha256 checksum {sha256} of dependency {name}: 64 hex digits expected"
+                    .format(sha256=self.sha256, name=self.name))
+
 
 class Project:
     def __init__(self, yaml_dict):
@@ -24,22 +125,54 @@ class Project:
 
     @staticmethod
     def from_root(root_dir):
-        import yaml
-        manifest_path = os.path.join(root_dir, "confu.yaml")
+        r"""Loads project manifest (confu.yaml) from the project root directory.
+
+        Parsed manifests are memoized by path, modification time and size of confu.yaml within the process, and
+        in the user-level manifest cache across processes (see :func:`get_manifest_cache_path`).
+        """
+
+        manifest_path = os.path.abspath(os.path.join(root_dir, "confu.yaml"))
         try:
-            with open(manifest_path) as manifest_file:
-                manifest_text = manifest_file.read()
-        except IOError as e:
+            stat = os.stat(manifest_path)
+        except OSError as e:
             logger.critical("failed to read project manifest {path}: {message}".format(
-                path=manifest_path, message=e.message))
+                path=manifest_path, message=e.strerror))
             raise
-        manifest_yaml = yaml.load(manifest_text)
+        key = (stat.st_mtime, stat.st_size)
+
+        cached = _projects.get(manifest_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        manifest_cache = _get_manifest_cache()
+        cached = manifest_cache.get(manifest_path)
+        if cached is not None and cached[0] == key:
+            manifest_yaml = cached[1]
+            import time
+            if time.time() - cached[2] > 86400:
+                # Refresh last use time (it orders manifests for eviction), but at most once a day
+                _update_manifest_cache(manifest_path, key, manifest_yaml)
+        else:
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifest_text = manifest_file.read()
+            except IOError as e:
+                logger.critical("failed to read project manifest {path}: {message}".format(
+                    path=manifest_path, message=e.strerror))
+                raise
+            manifest_yaml = load_yaml(manifest_text)
+
         try:
-            return Project(manifest_yaml)
+            project = Project(manifest_yaml)
         except:
             logger.critical("invalid project manifest " + manifest_path)
             raise
 
+        _projects[manifest_path] = (key, project)
+        if cached is None or cached[0] != key:
+            _update_manifest_cache(manifest_path, key, manifest_yaml)
+        return project
+
     def __str__(self):
         if self.title:
             return self.name + ": " + self.title
@@ -51,3 +184,47 @@ class Project:
             return str(self) + " (deps: " + " ".join(dep.name for dep in self.deps) + ")"
         else:
             return str(self)
+
+
+class Lock:
+    r"""Dependency lockfile (confu.lock) with resolved commits of git dependencies."""
+
+    def __init__(self, yaml_dict=None):
+        self.deps = dict()
+        if yaml_dict and yaml_dict.get("deps"):
+            for name, dependency_yaml in yaml_dict["deps"].items():
+                self.deps[name] = {key: dependency_yaml.get(key) for key in ["url", "ref", "commit"]}
+
+    @staticmethod
+    def from_root(root_dir):
+        lock_path = os.path.join(root_dir, "confu.lock")
+        if not os.path.isfile(lock_path):
+            return Lock()
+
+        with open(lock_path) as lock_file:
+            lock_yaml = load_yaml(lock_file.read())
+        try:
+            return Lock(lock_yaml)
+        except:
+            logger.critical("invalid lockfile " + lock_path)
+            raise
+
+    def is_current(self, dep):
+        r"""Checks if the locked commit was resolved from the same URL and ref as specified in the manifest."""
+
+        entry = self.deps.get(dep.name)
+        return entry is not None and entry["url"] == dep.url and entry["ref"] == dep.ref
+
+    def save(self, root_dir):
+        import yaml
+        lock_text = "# Generated by confu setup: resolved commits of git dependencies\n" + \
+            yaml.safe_dump({"deps": self.deps}, default_flow_style=False)
+
+        lock_path = os.path.join(root_dir, "confu.lock")
+        if os.path.isfile(lock_path):
+            with open(lock_path) as lock_file:
+                if lock_file.read() == lock_text:
+                    return
+
+        with open(lock_path, "w") as lock_file:
+            lock_file.write(lock_text)
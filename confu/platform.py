@@ -246,13 +246,8 @@ def detect_host():
     raise ValueError("Unexpected sys.platform, platform.machine combination ({sys.platform}, {machine})"
         .format(sys=sys, machine=machine))
 
-host = None
-if host is None:
-    host = Platform(detect_host())
-    logger.debug("host platform: " + host.name)
-
-
 def detect_possible_targets():
+    host = get_host()
     targets = [host.name]
     if os.getenv("ANDROID_SDK") is not None and os.getenv("ANDROID_NDK") is not None:
         targets.append("arm-android")
@@ -271,7 +266,36 @@ def detect_possible_targets():
         targets.append("wasm")
     return targets
 
-possible_targets = None
-if possible_targets is None:
-    possible_targets = detect_possible_targets()
-    logger.debug("possible target platforms:" + os.linesep + os.linesep.join("\t" + target for target in possible_targets))
+_host = None
+_possible_targets = None
+
+
+def get_host():
+    global _host
+    if _host is None:
+        _host = Platform(detect_host())
+        logger.debug("host platform: " + _host.name)
+    return _host
+
+
+def get_possible_targets():
+    global _possible_targets
+    if _possible_targets is None:
+        _possible_targets = detect_possible_targets()
+        logger.debug("possible target platforms:" + os.linesep +
+            os.linesep.join("\t" + target for target in _possible_targets))
+    return _possible_targets
+
+
+# Host and possible targets are detected on first access to confu.platform.host and confu.platform.possible_targets,
+# rather than when the module is imported
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name == "host":
+            return get_host()
+        elif name == "possible_targets":
+            return get_possible_targets()
+        raise AttributeError("module {module} has no attribute {name}".format(module=__name__, name=name))
+else:
+    host = get_host()
+    possible_targets = get_possible_targets()
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
 
-def setup(root_dir):
+def setup(root_dir, offline=False):
     import confu.git
-    repo = confu.git.clone("https://github.com/google/benchmark.git", root_dir)
+    confu.git.clone("https://github.com/google/benchmark.git", root_dir,
+        depth=1, offline=offline, sparse=["include", "src"])
 
     from os import path
     recipes_dir = path.dirname(path.abspath(__file__))
@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 
 
-def setup(root_dir):
+def setup(root_dir, offline=False):
     import confu.git
-    repo = confu.git.clone("https://github.com/google/googletest.git", root_dir)
-    repo.checkout("refs/tags/release-1.10.0")
+    confu.git.clone("https://github.com/google/googletest.git", root_dir,
+        ref="refs/tags/release-1.10.0", depth=1, offline=offline, sparse=["googletest"])
 
     from os import path
     recipes_dir = path.dirname(path.abspath(__file__))
@@ -1,3 +1,4 @@
 from confu.results.build import BuildResult
-from confu.results.compilcation import CompilationResult
+from confu.results.compilcation import CompilationResult, UnityCompilationResult, PrecompiledHeaderResult, \
+    ModuleCompilationResult
 from confu.results.collection import CollectionResult
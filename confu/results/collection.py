@@ -2,12 +2,12 @@ import os
 import collections
 
 from confu.results import BuildResult
-from confu.results import CompilationResult
+from confu.results import CompilationResult, UnityCompilationResult
 from confu.utils import qualified_type
 
 
 class CollectionResult(BuildResult):
-    def __init__(self, subdir, name, objects, libraries=None, filename=None, rule=None, extra_outputs=list(), extra_deps=list(), variables=dict()):
+    def __init__(self, subdir, name, objects, libraries=None, filename=None, rule=None, extra_outputs=list(), extra_deps=list(), variables=dict(), interface=None):
         super(CollectionResult, self).__init__()
         if not isinstance(subdir, str):
             raise TypeError("Unsupported type of subdir argument: string expected")
@@ -33,46 +33,99 @@ class CollectionResult(BuildResult):
         self.extra_outputs = extra_outputs
         self.extra_deps = extra_deps
         self.variables = variables
+        # Stamp with exported symbols of a shared library, which dependents use instead of the library itself
+        self.interface = interface
 
     def get_target_path(self):
+        from confu.utils import get_output_dir
+        return os.path.join(get_output_dir(self.subdir), self.filename)
+
+    def _get_unity_objects(self):
+        r"""Groups objects which can be compiled together into unity translation units.
+
+        Sources are batched only within a collection, because sources of different collections may define the same
+        symbols, e.g. main functions of different executables. Sources in a batch have the same compilation rule
+        and variables, i.e. the same macros, ISA extensions, include directories, and precompiled header.
+        """
+
         import confu.globals
-        return os.path.join(confu.globals.root_dir, self.subdir, self.filename)
+        if confu.globals.unity <= 1:
+            return self.objects
+
+        import hashlib
+        from confu.utils import get_output_dir
+        batches = collections.OrderedDict()
+        for object in self.objects:
+            if type(object) is CompilationResult and object.unity and object.rule in ["cc", "cxx"]:
+                key = (object.rule, tuple(sorted(object.variables.items())))
+                batches.setdefault(key, list()).append(object)
+
+        objects = list()
+        unity_objects = dict()
+        for (rule, variables), batch_objects in batches.items():
+            if len(batch_objects) == 1:
+                continue
+            flags_hash = hashlib.sha256("\0".join(name + "=" + value for name, value in variables)
+                                        .encode("utf-8")).hexdigest()[:16]
+            unity_dir = os.path.join(get_output_dir("build"), "unity", self.subdir, self.filename)
+            for index in range(0, len(batch_objects), confu.globals.unity):
+                chunk = batch_objects[index:index + confu.globals.unity]
+                if len(chunk) == 1:
+                    continue
+                unity_file = os.path.join(unity_dir, "{rule}-{hash}-{index}.{ext}".format(
+                    rule=rule, hash=flags_hash, index=index // confu.globals.unity, ext="c" if rule == "cc" else "cc"))
+                unity_object = UnityCompilationResult(unity_file, [object.source_file for object in chunk],
+                    chunk[0].target_platform, rule=rule, variables=chunk[0].variables, pch=chunk[0].pch)
+                unity_object.pic = chunk[0].pic
+                for object in chunk:
+                    unity_objects[id(object)] = unity_object
+
+        for object in self.objects:
+            unity_object = unity_objects.get(id(object), object)
+            if not any(unity_object is existing_object for existing_object in objects):
+                objects.append(unity_object)
+        return objects
 
     def generate(self, ninja):
         import confu.globals
+        from confu.utils import get_build_path, get_output_dir
         if self.generated:
-            return self.get_target_path()
+            return get_build_path(self.get_target_path())
 
         object_files = list()
-        for object in self.objects:
+        for object in self._get_unity_objects():
             assert isinstance(object, (CompilationResult, CollectionResult))
             object.generate(ninja)
             if isinstance(object, CompilationResult):
-                object_files.append(object.get_object_path())
+                object_files.append(get_build_path(object.get_object_path()))
             else:
-                object_files.append(object.get_target_path())
+                object_files.append(get_build_path(object.get_target_path()))
 
         library_files = list()
-        implicit_deps = list(self.extra_deps)
+        implicit_deps = [get_build_path(path) for path in self.extra_deps]
         if self.libraries:
             for library in self.libraries:
                 assert isinstance(library, (CollectionResult, str))
                 if isinstance(library, str):
                     library_files.append("-l" + library)
                 else:
-                    library.generate(ninja)
-                    library_files.append(library.get_target_path())
-                    implicit_deps.append(library.get_target_path())
+                    library_path = library.generate(ninja)
+                    library_files.append(library_path)
+                    # Changes in a shared library which keep its interface don't require relinking
+                    implicit_deps.append(get_build_path(library.interface) if library.interface else library_path)
 
-        target_path = self.get_target_path()
+        target_path = get_build_path(self.get_target_path())
         variables = self.variables.copy()
-        variables["path"] = os.path.join(self.subdir, self.filename)
+        variables["path"] = os.path.relpath(self.get_target_path(), confu.globals.root_dir)
         variables["ldlibs"] = " ".join(library_files + ["$ldlibs"])
         ninja.build(target_path, self.rule, object_files,
                     implicit=implicit_deps,
-                    implicit_outputs=[os.path.join(confu.globals.root_dir, self.subdir, extra_output)
+                    implicit_outputs=[get_build_path(os.path.join(get_output_dir(self.subdir), extra_output))
                                       for extra_output in self.extra_outputs],
-                    order_only=confu.globals.build_ninja_path, variables=variables)
+                    variables=variables)
+        if self.interface:
+            ninja.build(get_build_path(self.interface), "interface", target_path,
+                        variables={"path": variables["path"]})
 
         self.generated = True
         return target_path
@@ -4,27 +4,139 @@ from confu.results.build import BuildResult
 
 
 class CompilationResult(BuildResult):
-    def __init__(self, source_file, target_platform, rule=None, variables=dict()):
+    def __init__(self, source_file, target_platform, rule=None, variables=dict(), pch=None, unity=False):
         super(CompilationResult, self).__init__()
         self.target_platform = target_platform
         self.source_file = source_file
         self.rule = rule
         self.variables = variables
+        self.pch = pch
+        # Whether the source can be compiled as a part of a unity translation unit
+        self.unity = unity
+        # Whether the object is position-independent code for shared libraries
+        self.pic = False
 
     def get_object_path(self):
         import confu.globals
+        from confu.utils import get_output_dir
         rel_source_file = os.path.relpath(self.source_file, confu.globals.root_dir)
-        return os.path.join(confu.globals.root_dir, "build", rel_source_file) + self.target_platform.get_object_ext()
+        return os.path.join(get_output_dir("build"), rel_source_file) + \
+            self.target_platform.get_object_ext(self.pic)
 
     def generate(self, ninja):
         if self.generated:
             return
 
         import confu.globals
-        object_file = self.get_object_path()
+        from confu.utils import get_build_path
+        object_file = get_build_path(self.get_object_path())
         variables = self.variables.copy()
         variables["path"] = os.path.relpath(self.source_file, confu.globals.root_dir)
-        ninja.build(object_file, self.rule, self.source_file,
-            order_only=confu.globals.build_ninja_path, variables=variables)
+        implicit_deps = list(confu.globals.compile_deps)
+        if self.pch is not None:
+            self.pch.generate(ninja)
+            implicit_deps.append(get_build_path(self.pch.get_object_path()))
+        ninja.build(object_file, self.rule, get_build_path(self.source_file), implicit=implicit_deps,
+            variables=variables)
 
         self.generated = True
+
+
+class UnityCompilationResult(CompilationResult):
+    r"""Compilation of several sources, which share compilation flags, as a single translation unit.
+
+    The unity source file includes the sources, and is rewritten only when the list of sources changes.
+    """
+
+    def __init__(self, unity_file, sources, target_platform, rule=None, variables=dict(), pch=None):
+        super(UnityCompilationResult, self).__init__(unity_file, target_platform,
+            rule=rule, variables=variables, pch=pch)
+        self.sources = sources
+
+    def get_object_path(self):
+        return self.source_file + self.target_platform.get_object_ext(self.pic)
+
+    def generate(self, ninja):
+        if self.generated:
+            return
+
+        unity_dir = os.path.dirname(self.source_file)
+        if not os.path.isdir(unity_dir):
+            os.makedirs(unity_dir)
+        # Relative paths keep unity sources valid in relocatable builds
+        content = "".join("#include \"{path}\"\n".format(path=os.path.relpath(source, unity_dir).replace(os.sep, "/"))
+                          for source in self.sources)
+        from confu.utils import write_if_changed
+        write_if_changed(self.source_file, content)
+        import confu.globals
+        confu.globals.configure_outputs.append(self.source_file)
+
+        super(UnityCompilationResult, self).generate(ninja)
+
+
+class ModuleCompilationResult(CompilationResult):
+    r"""Compilation of a C++ source which may provide or import C++20 named modules.
+
+    The source is scanned for module dependencies before compilation. The collator combines the scans of all
+    sources into a ninja dyndep file, which orders compilations of modules before compilations which import them, and
+    writes module maps with paths to BMIs (compiled module interfaces) of provided and imported modules.
+    """
+
+    def __init__(self, source_file, target_platform, flavor, variables=dict(), pch=None):
+        super(ModuleCompilationResult, self).__init__(source_file, target_platform,
+            rule="cxx_module", variables=variables, pch=pch)
+        self.flavor = flavor
+
+    def generate(self, ninja):
+        if self.generated:
+            return
+
+        import confu.globals
+        from confu.utils import get_build_path, get_output_dir
+        from confu.cxxmodules import dyndep_filename, get_scan_path, get_modmap_path, get_modmap_flags
+        object_file = get_build_path(self.get_object_path())
+        source_file = get_build_path(self.source_file)
+        dyndep_file = get_build_path(os.path.join(get_output_dir("build"), dyndep_filename))
+        implicit_deps = [get_modmap_path(object_file)]
+        pch_deps = list()
+        if self.pch is not None:
+            self.pch.generate(ninja)
+            pch_deps.append(get_build_path(self.pch.get_object_path()))
+
+        variables = self.variables.copy()
+        variables["path"] = os.path.relpath(self.source_file, confu.globals.root_dir)
+        scan_variables = variables.copy()
+        scan_variables["object"] = object_file
+        ninja.build(get_scan_path(object_file), "cxx_scan", source_file, implicit=pch_deps,
+            variables=scan_variables)
+        confu.globals.cxx_module_scans.append(get_scan_path(object_file))
+
+        variables["modflags"] = get_modmap_flags(object_file, self.flavor)
+        variables["dyndep"] = dyndep_file
+        implicit_deps += pch_deps + confu.globals.compile_deps
+        ninja.build(object_file, self.rule, source_file, implicit=implicit_deps, order_only=dyndep_file,
+            variables=variables)
+
+        self.generated = True
+
+
+class PrecompiledHeaderResult(CompilationResult):
+    r"""Header precompiled with a particular set of compilation flags.
+
+    The precompiled header is stored as <include path>.gch, where <include path> is a non-existent file in
+    build/pch/<variant>/ directory: both gcc and clang look for precompiled <header>.gch when a source is compiled
+    with -include <header>.
+    """
+
+    def __init__(self, header_file, target_platform, variant, rule=None, variables=dict()):
+        super(PrecompiledHeaderResult, self).__init__(header_file, target_platform, rule=rule, variables=variables)
+        self.variant = variant
+
+    def get_include_path(self):
+        import confu.globals
+        from confu.utils import get_output_dir
+        rel_header_file = os.path.relpath(self.source_file, confu.globals.root_dir)
+        return os.path.join(get_output_dir("build"), "pch", self.variant, rel_header_file)
+
+    def get_object_path(self):
+        return self.get_include_path() + ".gch"
@@ -34,8 +34,9 @@ class PeachPy(Tool):
     		"x86_64-nacl-newlib": ("nacl", "elf"),
     		"x86_64-nacl-gnu":    ("nacl", "elf"),
     	}[self.target]
+    	from confu.cache import get_rule_prefix
     	ninja.rule("peachpy",
-    		"$peachpy -mabi={abi} -g4 -mimage-format={imageformat} $includes -MMD -MF $out.d -o $out $in"
+    		get_rule_prefix() + "$peachpy -mabi={abi} -g4 -mimage-format={imageformat} $includes -MMD -MF $out.d -o $out $in"
     			.format(abi=abi, imageformat=imageformat),
             deps="gcc", depfile="$out.d",
             description="PEACHPY $path")
@@ -75,6 +75,7 @@ class AndroidToolchain(UnixToolchain):
             self.cxx    = os.path.join(toolchain_prefix, toolchain_name + "-g++" + toolchain_suffix)
             self.ar     = os.path.join(toolchain_prefix, toolchain_name + "-gcc-ar" + toolchain_suffix)
             self.ranlib = os.path.join(toolchain_prefix, toolchain_name + "-gcc-ranlib" + toolchain_suffix)
+            self.nm     = os.path.join(toolchain_prefix, toolchain_name + "-nm" + toolchain_suffix)
         elif toolchain == "clang":
             llvm_toolchain_prefix = os.path.join(self.ndk_root, "toolchains", "llvm", "prebuilt", host_tag, "bin")
             self.cc     = os.path.join(llvm_toolchain_prefix, "clang" + toolchain_suffix)
@@ -85,6 +86,7 @@ class AndroidToolchain(UnixToolchain):
 
             self.ar     = os.path.join(toolchain_prefix, toolchain_name + "-ar" + toolchain_suffix)
             self.ranlib = os.path.join(toolchain_prefix, toolchain_name + "-ranlib" + toolchain_suffix)
+            self.nm     = os.path.join(toolchain_prefix, toolchain_name + "-nm" + toolchain_suffix)
 
         # Generic flags.
         self.cflags += [
@@ -110,12 +112,14 @@ class AndroidToolchain(UnixToolchain):
             "-Wl,--warn-shared-textrel",
             "-Wl,--fatal-warnings",
         ]
-        # should be only for executables
         self.ldflags += [
-            "-pie",
             "-Wl,--gc-sections",
             "-Wl,-z,nocopyreloc",
         ]
+        # Shared libraries are linked with -shared instead
+        self.executable_ldflags += [
+            "-pie",
+        ]
 
         if toolchain == "clang":
             self.cflags.append("-fno-limit-debug-info")
@@ -225,7 +229,7 @@ class AndroidToolchain(UnixToolchain):
         ninja.variable("adb", os.path.join(self.sdk_root, "platform-tools", "adb"))
 
     def write_rules(self, ninja):
-        super(AndroidToolchain, self).write_rules(ninja, write_library=False, write_run=False)
+        super(AndroidToolchain, self).write_rules(ninja, write_run=False)
 
         ninja.rule("run", "$adb push $in /data/local/tmp/$path && $adb shell /data/local/tmp/$path $args",
             description="RUN $path", pool="console")
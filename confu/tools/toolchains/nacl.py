@@ -101,7 +101,7 @@ class NaClToolchain(UnixToolchain):
             ninja.rule("finalize", "$finalize --compress -o $out $in",
                 description="FINALIZE $path")
             ninja.rule("translate", "$translate --allow-llvm-bitcode-input -O3 -threads=auto -arch x86-64 $in -o $out",
-                description="TRANSLATE $path")
+                description="TRANSLATE $path", pool="link")
 
         ninja.rule("run", "$sel_ldr -p -- $in $args",
             description="RUN $path", pool="console")
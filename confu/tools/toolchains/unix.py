@@ -1,8 +1,16 @@
 from __future__ import absolute_import
 
+import logging
+
 from confu.tools.toolchains import Toolchain
 
 
+logger = logging.getLogger("confu")
+
+# Results of compiler flag probes: (compiler, flag) -> True if the flag is supported
+_supported_flags = dict()
+
+
 class UnixToolchain(Toolchain):
     def __init__(self, target):
         super(UnixToolchain, self).__init__(target)
@@ -12,10 +20,27 @@ class UnixToolchain(Toolchain):
         self.ranlib = None
         self.strip = None
         self.objcopy = None
+        self.nm = None
+        # Compiler launcher (e.g. ccache or sccache) which wraps compilation commands
+        self.launcher = None
+        # Compiler flavor ("gcc" or "clang") for C++20 modules with dependency scanning, or None if disabled
+        self.cxx_modules = None
+        self.scan_deps = None
+        # Profile-guided optimization: mode ("generate" or "use"), profile source, and tools for training
+        self.pgo_mode = None
+        self.pgo_source = None
+        self.pgo_dir = None
+        self.pgo_profile = None
+        self.profdata = None
+        self.perf = None
+        self.autofdo_convert = None
+        self.autofdo_merge = None
 
         self.cflags = ["-std=gnu99" if self.target.is_nacl or self.target.is_pnacl else "-std=gnu11", "-g"]
         self.cxxflags = ["-std=gnu++0x" if self.target == "x86_64-nacl-gnu" else "-std=gnu++11", "-g"]
         self.ldflags = []
+        # Linker flags for executables only, e.g. -pie, which is incompatible with -shared
+        self.executable_ldflags = []
         self.ldlibs = []
         self.optflag = "-O2"
         if self.target.is_glibc or self.target.is_freebsd:
@@ -23,6 +48,347 @@ class UnixToolchain(Toolchain):
             self.cxxflags.append("-pthread")
             self.ldflags.append("-pthread")
 
+    def supports_flag(self, flag):
+        r"""Checks if the C compiler accepts a flag by compiling an empty source file with it."""
+
+        key = (self.cc, flag)
+        if key not in _supported_flags:
+            _supported_flags[key] = self._probe(self.cflags + [flag, "-c"], "int f(void) { return 0; }\n")
+        return _supported_flags[key]
+
+    def supports_link_flags(self, flags):
+        r"""Checks if the linker accepts flags by linking an empty program with them."""
+
+        key = (self.cc, "link") + tuple(flags)
+        if key not in _supported_flags:
+            _supported_flags[key] = self._probe(self.cflags + self.ldflags + flags, "int main(void) { return 0; }\n")
+        return _supported_flags[key]
+
+    def _probe(self, flags, source):
+        # Outputs go to a temporary directory, because some flags produce extra files next to the output, e.g. .dwo
+        import os
+        import shutil
+        import tempfile
+        import subprocess
+        temp_dir = tempfile.mkdtemp(prefix="confu-")
+        try:
+            source_path = os.path.join(temp_dir, "probe.c")
+            with open(source_path, "w") as source_file:
+                source_file.write(source)
+            with open(os.devnull, "r+b") as devnull:
+                try:
+                    return subprocess.call([self.cc] + flags + [source_path, "-o", os.path.join(temp_dir, "probe")],
+                        stdin=devnull, stdout=devnull, stderr=devnull) == 0
+                except OSError:
+                    return False
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _find_compiler_tool(self, compiler_name, tool_name):
+        r"""Finds a tool installed alongside the C compiler, e.g. gcc-ar-12 for gcc-12 or llvm-ar-17 for clang-17.
+
+        :returns: path or name of the tool, or None if it is not installed.
+        """
+
+        import os
+        from confu.utils import find_executable
+        cc_dir, cc_name = os.path.split(self.cc)
+        if compiler_name not in cc_name:
+            return None
+        prefix, _, suffix = cc_name.rpartition(compiler_name)
+        if compiler_name == "clang":
+            # LLVM tools don't have target prefixes, e.g. clang-17 and x86_64-linux-gnu-clang-17 use llvm-ar-17
+            prefix = ""
+        tool = prefix + tool_name + suffix
+        if cc_dir:
+            tool = os.path.join(cc_dir, tool)
+            return tool if os.path.isfile(tool) else None
+        return tool if find_executable(tool) is not None else None
+
+    def set_profile(self, profile):
+        r"""Sets optimization and debug information flags of a build profile.
+
+        :param str profile: "debug" (no optimization), "release" (optimization without debug information and
+            assertions), "relwithdebinfo" (optimization with debug information, without assertions), or "custom"
+            (default flags extended with CFLAGS, CXXFLAGS, and LDFLAGS environment variables).
+        """
+
+        if profile == "debug":
+            self.optflag = "-O0"
+        elif profile in ["release", "relwithdebinfo"]:
+            self.optflag = "-O2"
+            if profile == "release":
+                self.cflags = [flag for flag in self.cflags if flag != "-g"]
+                self.cxxflags = [flag for flag in self.cxxflags if flag != "-g"]
+            self.cflags.append("-DNDEBUG")
+            self.cxxflags.append("-DNDEBUG")
+        elif profile == "custom":
+            import os
+            import shlex
+            self.cflags += shlex.split(os.getenv("CFLAGS", ""))
+            self.cxxflags += shlex.split(os.getenv("CXXFLAGS", ""))
+            self.ldflags += shlex.split(os.getenv("LDFLAGS", ""))
+        else:
+            raise ValueError("Unsupported build profile {profile}: "
+                             "'debug', 'release', 'relwithdebinfo', or 'custom' expected".format(profile=profile))
+
+    def select_linker(self, linker):
+        r"""Makes the compiler driver link with the specified linker: "bfd", "gold", "lld", or "mold"."""
+
+        if self.target.is_emscripten or self.target.is_nacl or self.target.is_pnacl:
+            raise EnvironmentError("Linker selection is not supported for {target}".format(target=self.target))
+
+        link_flag_variants = [["-fuse-ld=" + linker]]
+        if linker == "mold":
+            # gcc before 12.1 doesn't know -fuse-ld=mold, but mold installs an ld wrapper for -B option
+            link_flag_variants += [["-B" + mold_dir] for mold_dir in ["/usr/libexec/mold", "/usr/local/libexec/mold"]]
+        for link_flags in link_flag_variants:
+            if self.supports_link_flags(link_flags):
+                self.ldflags += link_flags
+                return
+        raise EnvironmentError("{linker} linker is not supported by {cc} compiler or not installed"
+                               .format(linker=linker, cc=self.cc))
+
+    def enable_fast_link(self, split_dwarf=True):
+        r"""Reduces the amount of debug information which the linker reads and writes.
+
+        Enables, if supported, debug information in separate .dwo files which the linker doesn't process
+        (-gsplit-dwarf), compression of debug information (-gz=zlib), and an index which lets gdb skip reading
+        of debug information on startup (--gdb-index).
+        """
+
+        compile_flags = list()
+        if split_dwarf:
+            compile_flags.append("-gsplit-dwarf")
+        compile_flags.append("-gz=zlib")
+        for flag in compile_flags:
+            if self.supports_flag(flag):
+                self.cflags.append(flag)
+                self.cxxflags.append(flag)
+            else:
+                logger.debug("compiler {cc} doesn't support {flag}".format(cc=self.cc, flag=flag))
+
+        for flag in ["-Wl,--gdb-index", "-gz=zlib"]:
+            if self.supports_link_flags([flag]):
+                self.ldflags.append(flag)
+            else:
+                logger.debug("linker of {cc} doesn't support {flag}".format(cc=self.cc, flag=flag))
+
+    def enable_lto(self, mode, jobs, cache_dir):
+        r"""Configures the toolchain for link-time optimization.
+
+        :param str mode: "full" for monolithic LTO (gcc or clang), or "thin" for ThinLTO (clang only).
+        :param int jobs: number of parallel LTO backend jobs for each link.
+        :param str cache_dir: directory for the ThinLTO cache of backend results.
+        """
+
+        import os
+        if self.target.is_nacl or self.target.is_pnacl:
+            raise EnvironmentError("Link-time optimization is not supported for {target}".format(target=self.target))
+        is_clang = "clang" in os.path.basename(self.cc) or self.target.is_emscripten
+        if mode == "thin" and not is_clang:
+            raise EnvironmentError("ThinLTO is not supported by {cc} compiler".format(cc=self.cc))
+
+        lto_flag = "-flto=thin" if mode == "thin" else "-flto"
+        self.cflags.append(lto_flag)
+        self.cxxflags.append(lto_flag)
+        if is_clang:
+            link_lto_flag = lto_flag
+        else:
+            # gcc runs LTO backends in parallel processes. Only ninja 1.13+ can act as a jobserver, and build.ninja
+            # doesn't know which ninja runs it, so the number of processes is explicit: processors per link slot.
+            link_lto_flag = "-flto={jobs}".format(jobs=jobs)
+        # Code generation happens at link time, and needs optimization flags
+        self.ldflags += [self.optflag, link_lto_flag]
+
+        if self.target.is_emscripten:
+            # emar and wasm-ld in Emscripten SDK handle LTO objects
+            return
+
+        if is_clang:
+            archiver, indexer = self._find_compiler_tool("clang", "llvm-ar"), \
+                self._find_compiler_tool("clang", "llvm-ranlib")
+        else:
+            archiver, indexer = self._find_compiler_tool("gcc", "gcc-ar"), \
+                self._find_compiler_tool("gcc", "gcc-ranlib")
+        if archiver is not None:
+            self.ar = archiver
+            if indexer is not None:
+                self.ranlib = indexer
+        else:
+            logger.warning("LTO-aware archiver for {cc} is not installed: static libraries may lack symbol index "
+                           "for LTO objects".format(cc=self.cc))
+
+        if mode == "thin":
+            # Linker flags for parallel ThinLTO backends and the cache of their results depend on the linker
+            if self.target.is_macos:
+                link_flag_variants = [["-Wl,-mllvm,-threads={jobs}", "-Wl,-cache_path_lto,{cache_dir}"]]
+            else:
+                link_flag_variants = [
+                    ["-Wl,--thinlto-jobs={jobs}", "-Wl,--thinlto-cache-dir={cache_dir}"],    # lld
+                    ["-Wl,-plugin-opt,jobs={jobs}", "-Wl,-plugin-opt,cache-dir={cache_dir}"],  # gold and bfd
+                ]
+            for link_flags in link_flag_variants:
+                link_flags = [flag.format(jobs=jobs, cache_dir=cache_dir) for flag in link_flags]
+                if self.supports_link_flags(link_flags):
+                    self.ldflags += link_flags
+                    break
+            else:
+                logger.warning("linker of {cc} doesn't support options for parallel ThinLTO".format(cc=self.cc))
+
+    def enable_pgo(self, mode, source, pgo_dir, profile_path=None):
+        r"""Configures the toolchain for profile-guided optimization.
+
+        :param str mode: "generate" to build binaries which collect profiles, or "use" to optimize with a profile.
+        :param str source: "instrumentation" for profiles of instrumented binaries, or "sampling" for AutoFDO profiles
+            converted from samples of perf record.
+        :param str pgo_dir: directory for training outputs and the collected profile.
+        :param str profile_path: profile to optimize with instead of the profile collected in pgo_dir. For
+            instrumentation profiles of gcc, this is the directory with .gcda files.
+        """
+
+        import os
+        from confu.utils import find_executable
+        is_clang = "clang" in os.path.basename(self.cc) or self.target.is_emscripten
+        self.pgo_mode = mode
+        self.pgo_source = source
+        self.pgo_dir = pgo_dir
+        self.pgo_profile = profile_path
+        if self.pgo_profile is None:
+            # gcc writes instrumentation profiles next to objects, and training only updates a stamp file
+            profile_name = {
+                (False, "instrumentation"): "profile.stamp",
+                (True, "instrumentation"): "default.profdata",
+                (False, "sampling"): "default.afdo",
+                (True, "sampling"): "default.prof",
+            }[(is_clang, source)]
+            self.pgo_profile = os.path.join(pgo_dir, profile_name)
+
+        if mode == "generate":
+            if source == "instrumentation":
+                if is_clang:
+                    flags = ["-fprofile-generate=" + os.path.join(pgo_dir, "raw")]
+                else:
+                    flags = ["-fprofile-generate", "-fprofile-update=atomic"]
+                self.ldflags += flags
+            else:
+                # Sampling profiles are collected from regular optimized binaries with debug information
+                flags = ["-fdebug-info-for-profiling"] if is_clang else list()
+                self.perf = find_executable("perf")
+                self.autofdo_convert = find_executable("create_llvm_prof" if is_clang else "create_gcov")
+                if not is_clang:
+                    self.autofdo_merge = find_executable("profile_merger")
+                if None in [self.perf, self.autofdo_convert] or not is_clang and self.autofdo_merge is None:
+                    raise EnvironmentError("Sampling profiles require perf and AutoFDO tools ({tools}) to be installed"
+                        .format(tools="create_llvm_prof" if is_clang else "create_gcov, profile_merger"))
+            if is_clang:
+                self.profdata = self._find_compiler_tool("clang", "llvm-profdata") or find_executable("llvm-profdata")
+                if self.profdata is None:
+                    raise EnvironmentError("Profiles of {cc} require llvm-profdata to be installed".format(cc=self.cc))
+        else:
+            if source == "instrumentation":
+                if is_clang:
+                    flags = ["-fprofile-use=" + self.pgo_profile]
+                else:
+                    flags = ["-fprofile-use" if profile_path is None else "-fprofile-use=" + profile_path,
+                             "-Wno-missing-profile"]
+                    if self.supports_flag("-fprofile-partial-training"):
+                        # Code which training didn't run is optimized as usual, rather than for size
+                        flags.append("-fprofile-partial-training")
+            elif is_clang:
+                flags = ["-fprofile-sample-use=" + self.pgo_profile, "-fdebug-info-for-profiling"]
+            else:
+                flags = ["-fauto-profile=" + self.pgo_profile]
+        self.cflags += flags
+        self.cxxflags += flags
+
+    def write_pgo_training(self, ninja, binaries):
+        r"""Generates the pgo target, which runs binaries to collect profiles and merges the profiles.
+
+        :param list binaries: tuples of names and paths of the binaries to run.
+        """
+
+        import os
+        training_outputs = list()
+        for name, binary in binaries:
+            if self.pgo_source == "instrumentation":
+                stamp = os.path.join(self.pgo_dir, name + ".stamp")
+                ninja.build(stamp, "pgo_run", binary,
+                    variables={"path": name, "rawdir": os.path.join(self.pgo_dir, "raw")})
+                training_outputs.append(stamp)
+            else:
+                perf_data = os.path.join(self.pgo_dir, name + ".perf.data")
+                ninja.build(perf_data, "pgo_record", binary, variables={"path": name})
+                profile = os.path.join(self.pgo_dir, name + (".prof" if self.profdata is not None else ".afdo"))
+                ninja.build(profile, "pgo_convert", perf_data, implicit=[binary],
+                    variables={"path": name, "binary": binary})
+                training_outputs.append(profile)
+
+        ninja.build(self.pgo_profile, "pgo_merge", training_outputs,
+            variables={"rawdir": os.path.join(self.pgo_dir, "raw")})
+        ninja.build("pgo", "phony", self.pgo_profile)
+
+    def add_prefix_map(self, old_prefix, new_prefix):
+        r"""Makes the compiler replace a path prefix in debug information, __FILE__ macros and other outputs.
+
+        Uses -ffile-prefix-map if the compiler supports it (gcc 8+, clang 10+), and -fdebug-prefix-map and
+        -fmacro-prefix-map otherwise.
+        """
+
+        prefix_map = "{old}={new}".format(old=old_prefix, new=new_prefix)
+        if self.supports_flag("-ffile-prefix-map=" + prefix_map):
+            flags = ["-ffile-prefix-map=" + prefix_map]
+        else:
+            flags = [flag + prefix_map for flag in ["-fdebug-prefix-map=", "-fmacro-prefix-map="]
+                     if self.supports_flag(flag + prefix_map)]
+            if not flags:
+                logger.warning("compiler {cc} doesn't support prefix maps: paths of the build directory "
+                               "will remain in debug information".format(cc=self.cc))
+        self.cflags += flags
+        self.cxxflags += flags
+
+    def enable_cxx_modules(self, mode, module_cache_dir):
+        r"""Configures the toolchain for C++ modules.
+
+        :param str mode: "named" for C++20 named modules, which sources are scanned for with P1689 dependency scanner
+            of gcc 14+ or clang-scan-deps, or "clang" for Clang header modules cached in module_cache_dir.
+        """
+
+        import os
+        is_clang = self.cxx is not None and "clang" in os.path.basename(self.cxx)
+        if mode == "clang":
+            if not is_clang:
+                raise EnvironmentError("Clang modules are not supported by {cxx} compiler".format(cxx=self.cxx))
+            flags = ["-fmodules", "-fmodules-cache-path=" + module_cache_dir]
+            self.cflags += flags
+            self.cxxflags += flags
+            return
+
+        if is_clang:
+            # clang-scan-deps is versioned like the compiler, e.g. clang++-17 comes with clang-scan-deps-17
+            from confu.utils import find_executable
+            cxx_dir, cxx_name = os.path.split(self.cxx)
+            scan_deps_name = "clang-scan-deps" + cxx_name[cxx_name.index("clang++") + len("clang++"):] \
+                if "clang++" in cxx_name else "clang-scan-deps"
+            candidates = [os.path.join(cxx_dir, scan_deps_name)] if cxx_dir else list()
+            candidates += [find_executable(scan_deps_name), find_executable("clang-scan-deps")]
+            self.scan_deps = next((path for path in candidates if path is not None and os.path.isfile(path)), None)
+            if self.scan_deps is None:
+                raise EnvironmentError("C++ modules require clang-scan-deps, but it is not installed")
+            self.cxx_modules = "clang"
+        else:
+            import subprocess
+            try:
+                version = subprocess.check_output([self.cxx, "-dumpfullversion", "-dumpversion"]).decode("ascii")
+                major_version = int(version.strip().split(".")[0])
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                major_version = 0
+            if major_version < 14:
+                raise EnvironmentError("C++ modules require gcc 14 or newer, or clang with clang-scan-deps")
+            self.cxx_modules = "gcc"
+
+        self.cxxflags = [flag if not flag.startswith("-std=") else "-std=gnu++20" for flag in self.cxxflags]
+
     def write_variables(self, ninja):
         if self.cc is not None:
             ninja.variable("cc", self.cc)
@@ -36,41 +402,140 @@ class UnixToolchain(Toolchain):
             ninja.variable("strip", self.strip)
         if self.objcopy is not None:
             ninja.variable("objcopy", self.objcopy)
+        if self.nm is not None:
+            ninja.variable("nm", self.nm)
+        if self.launcher is not None:
+            ninja.variable("launcher", self.launcher)
+
+        if self.scan_deps is not None:
+            ninja.variable("scandeps", self.scan_deps)
+        if self.cxx_modules is not None:
+            from confu.cxxmodules import get_command
+            ninja.variable("cxxmodules", get_command())
+        for name in ["profdata", "perf", "autofdo_convert", "autofdo_merge"]:
+            if getattr(self, name) is not None:
+                ninja.variable(name, getattr(self, name))
 
         ninja.variable("cflags", " ".join(self.cflags))
         ninja.variable("cxxflags", " ".join(self.cxxflags))
         ninja.variable("ldflags", " ".join(self.ldflags))
+        if self.executable_ldflags:
+            ninja.variable("exeldflags", " ".join(self.executable_ldflags))
         ninja.variable("ldlibs", " ".join(self.ldlibs))
         ninja.variable("optflags", self.optflag)
 
     def write_rules(self, ninja, write_library=True, write_run=True):
-        ninja.rule("cc", "$cc -o $out -c $in -MMD -MF $out.d $cflags $optflags $macro $includes",
+        from confu.cache import get_rule_prefix
+        compile_prefix = get_rule_prefix() + ("$launcher " if self.launcher is not None else "")
+        ninja.rule("cc", compile_prefix + "$cc -o $out -c $in -MMD -MF $out.d $cflags $optflags $macro $includes $pch",
                    deps="gcc", depfile="$out.d",
                    description="CC $path")
 
-        ninja.rule("cxx", "$cxx -o $out -c $in -MMD -MF $out.d $cxxflags $optflags $macro $includes",
+        ninja.rule("cxx", compile_prefix + "$cxx -o $out -c $in -MMD -MF $out.d $cxxflags $optflags $macro $includes $pch",
                    deps="gcc", depfile="$out.d",
                    description="CXX $path")
 
+        # Dependency files of precompiled headers are kept (no deps="gcc"): the object cache reads them to hash the
+        # headers which sources include through the precompiled header
+        ninja.rule("cc_pch",
+                   compile_prefix + "$cc -x c-header -o $out -c $in -MMD -MF $out.d $cflags $optflags $macro $includes",
+                   depfile="$out.d",
+                   description="PCH $path")
+
+        ninja.rule("cxx_pch",
+                   compile_prefix + "$cxx -x c++-header -o $out -c $in -MMD -MF $out.d $cxxflags $optflags $macro $includes",
+                   depfile="$out.d",
+                   description="PCH $path")
+
+        if self.cxx_modules is not None:
+            self._write_cxx_modules_rules(ninja)
+        if self.pgo_mode == "generate":
+            self._write_pgo_rules(ninja)
+
         emscripten_linker_flags = ""
         if self.target.is_emscripten:
             if self.target.is_wasm:
                 emscripten_linker_flags = "$optflags -s WASM=1 $emflags "
             else:
                 emscripten_linker_flags = "$optflags $emflags "
-        ninja.rule("executable", "$linker {emscripten_flags}$ldflags $lddirs -o $out $in $ldlibs"
-                   .format(emscripten_flags=emscripten_linker_flags),
-                   description="LINK $path")
+        ninja.rule("executable", "$linker {emscripten_flags}$ldflags{executable_flags} $lddirs -o $out $in $ldlibs"
+                   .format(emscripten_flags=emscripten_linker_flags,
+                           executable_flags=" $exeldflags" if self.executable_ldflags else ""),
+                   description="LINK $path", pool="link")
 
         if write_library:
             ninja.rule("library", "$linker {emscripten_flags}{library_flag} $ldflags $lddirs -o $out $in $ldlibs"
                        .format(library_flag="-dynamiclib" if self.target.is_macos else "-shared",
                        emscripten_flags=emscripten_linker_flags),
-                       description="LINK $path")
+                       description="LINK $path", pool="link")
+
+        if self.nm is not None:
+            # Interface of a shared library is the list of its exported symbols. The stamp is rewritten only if
+            # the list changes, and restat lets ninja skip relinking of dependents if the interface is the same.
+            # The rule is written whenever nm is known, because dynamic_library emits interface edges if it is.
+            ninja.rule("interface", "$nm {nm_flags} $in | cut -d \" \" -f 1,2 | LC_ALL=C sort > $out.tmp && "
+                       "if cmp -s $out.tmp $out; then rm -f $out.tmp; else mv -f $out.tmp $out; fi"
+                       .format(nm_flags="-g -U -P" if self.target.is_macos else "--dynamic --defined-only -P"),
+                       description="INTERFACE $path", restat=True)
 
-        ninja.rule("archive", "$ar rcs $out $in",
+        ninja.rule("archive", get_rule_prefix(depfile=False) + "$ar rcs $out $in",
                    description="AR $path")
 
         if write_run:
             ninja.rule("run", "$in $args",
                        description="RUN $path", pool="console")
+
+    def _write_cxx_modules_rules(self, ninja):
+        # Scanners write P1689 JSON with modules which the source provides and imports
+        if self.cxx_modules == "gcc":
+            ninja.rule("cxx_scan", "$cxx -E -x c++ $in -o $out.i -MT $out -MMD -MF $out.d $cxxflags $optflags $macro "
+                                   "$includes $pch -fmodules-ts -fdeps-format=p1689r5 -fdeps-file=$out "
+                                   "-fdeps-target=$object",
+                       deps="gcc", depfile="$out.d",
+                       description="SCAN $path")
+        else:
+            ninja.rule("cxx_scan", "$scandeps -format=p1689 -- $cxx -x c++ $in -c -o $object "
+                                   "-MT $out -MD -MF $out.d $cxxflags $optflags $macro $includes $pch "
+                                   "> $out.tmp && mv $out.tmp $out",
+                       deps="gcc", depfile="$out.d",
+                       description="SCAN $path")
+
+        # Compilations read names and paths of BMIs from module maps, which are written by the collator
+        ninja.rule("cxx_module",
+                   "$cxx $modflags -o $out -c $in -MMD -MF $out.d $cxxflags $optflags $macro $includes $pch",
+                   deps="gcc", depfile="$out.d",
+                   description="CXX $path")
+
+        ninja.rule("cxx_collate",
+                   "$cxxmodules --flavor {flavor} --bmi-dir $bmidir --dyndep $out $in".format(flavor=self.cxx_modules),
+                   restat=True,
+                   description="COLLATE C++ modules")
+
+    def _write_pgo_rules(self, ninja):
+        # Training runs one binary at a time: concurrent runs would disturb timing-dependent code paths
+        if self.pgo_source == "instrumentation":
+            if self.profdata is not None:
+                ninja.rule("pgo_run", "rm -f $rawdir/$path-*.profraw && LLVM_PROFILE_FILE=$rawdir/$path-%p.profraw $in "
+                                      "&& touch $out",
+                           description="TRAIN $path", pool="console")
+                ninja.rule("pgo_merge", "$profdata merge -o $out $rawdir/*.profraw",
+                           description="MERGE PROFILES")
+            else:
+                # gcc merges counters into .gcda files next to objects when instrumented binaries exit
+                ninja.rule("pgo_run", "$in && touch $out",
+                           description="TRAIN $path", pool="console")
+                ninja.rule("pgo_merge", "touch $out",
+                           description="MERGE PROFILES")
+        else:
+            ninja.rule("pgo_record", "$perf record -b -o $out -- $in",
+                       description="RECORD $path", pool="console")
+            if self.profdata is not None:
+                ninja.rule("pgo_convert", "$autofdo_convert --binary=$binary --profile=$in --out=$out",
+                           description="CONVERT $path")
+                ninja.rule("pgo_merge", "$profdata merge -sample -o $out $in",
+                           description="MERGE PROFILES")
+            else:
+                ninja.rule("pgo_convert", "$autofdo_convert --binary=$binary --profile=$in --gcov=$out -gcov_version=1",
+                           description="CONVERT $path")
+                ninja.rule("pgo_merge", "$autofdo_merge --output_file=$out $in",
+                           description="MERGE PROFILES")
@@ -31,3 +31,196 @@ def qualified_type(var):
             return type
         else:
             return module + "." + type
+
+
+def get_cache_dir(*subdirs):
+    r"""Returns the user-level confu cache directory (or its subdirectory), shared by all projects.
+
+    The location is $CONFU_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/confu or ~/.cache/confu.
+    """
+
+    import os
+    cache_dir = os.getenv("CONFU_CACHE_DIR")
+    if not cache_dir:
+        xdg_cache_home = os.getenv("XDG_CACHE_HOME")
+        if not xdg_cache_home:
+            xdg_cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(xdg_cache_home, "confu")
+    return os.path.join(cache_dir, *subdirs)
+
+
+def get_directory_size(path):
+    import os
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def find_executable(name):
+    try:
+        from shutil import which         # Python 3.3+
+    except ImportError:
+        from distutils.spawn import find_executable as which
+    return which(name)
+
+
+def _list_directory(path):
+    import os
+    import confu.globals
+    entries = confu.globals.stat_cache.get(path)
+    if entries is not None:
+        confu.globals.stat_cache_hits += 1
+        return entries
+
+    confu.globals.stat_cache_misses += 1
+    entries = dict()
+    try:
+        if hasattr(os, "scandir"):
+            # Python 3.5+: file types come with the directory listing, without a stat call per entry
+            for entry in os.scandir(path):
+                try:
+                    entries[entry.name] = (entry.is_file(), entry.is_dir())
+                except OSError:
+                    entries[entry.name] = (False, False)
+        else:
+            for name in os.listdir(path):
+                entries[name] = (os.path.isfile(os.path.join(path, name)), os.path.isdir(os.path.join(path, name)))
+    except OSError:
+        # Directory doesn't exist or can't be listed
+        pass
+    confu.globals.stat_cache[path] = entries
+    return entries
+
+
+def is_file(path):
+    r"""Checks if a file exists, using the per-configure cache of directory listings.
+
+    Each directory is listed once, and later checks for entries of the same directory don't access the file system.
+    The path must be absolute and normalized.
+    """
+
+    import os
+    dirname, basename = os.path.split(path)
+    entry = _list_directory(dirname).get(basename) if basename else None
+    if entry is None:
+        # Not in the listing: check the file system, e.g. for a different case on case-insensitive file systems
+        return os.path.isfile(path)
+    # Neither a file nor a directory for special files and broken symbolic links
+    is_file, is_dir = entry
+    return is_file
+
+
+def is_dir(path):
+    r"""Checks if a directory exists, using the per-configure cache of directory listings (see :func:`is_file`)."""
+
+    import os
+    dirname, basename = os.path.split(path)
+    entry = _list_directory(dirname).get(basename) if basename else None
+    if entry is None:
+        # Not in the listing, or the file system root
+        return os.path.isdir(path)
+    is_file, is_dir = entry
+    return is_dir
+
+
+def write_if_changed(path, content):
+    r"""Writes text content to a file, unless the file already has the same content.
+
+    The content is written to a temporary file first, and then atomically replaces the file, so that an interrupted
+    write never leaves a truncated file behind.
+
+    :returns: True if the file was written, False if it was left unchanged.
+    """
+
+    import os
+    import tempfile
+    try:
+        with open(path) as file:
+            if file.read() == content:
+                return False
+    except IOError:
+        pass
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+        prefix="." + os.path.basename(path) + "-")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        # Temporary files are created with 0600 permissions, but the file should get the default ones
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        if hasattr(os, "replace"):
+            os.replace(temp_path, path)  # Python 3.3+, also replaces files on Windows
+        else:
+            os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+    return True
+
+
+def get_output_dir(subdir):
+    r"""Returns the directory for outputs of a kind: "build" for intermediate files, "bin", "lib", or "out".
+
+    Every build profile has its own output directories, e.g. build/debug and bin/debug, so that switching between
+    profiles doesn't replace outputs of other profiles.
+    """
+
+    import os
+    import confu.globals
+    if confu.globals.profile is None:
+        return os.path.join(confu.globals.root_dir, subdir)
+    else:
+        return os.path.join(confu.globals.root_dir, subdir, confu.globals.profile)
+
+
+def get_build_path(path):
+    r"""Converts an absolute path to the form used in build.ninja.
+
+    In relocatable builds, paths inside the root directory are made relative to it: ninja runs commands from the
+    root directory, and commands without absolute paths produce identical outputs in any checkout.
+    """
+
+    import os
+    import confu.globals
+    if confu.globals.relocatable and os.path.isabs(path):
+        root_dir = confu.globals.root_dir
+        if path == root_dir:
+            return "."
+        elif path.startswith(root_dir.rstrip(os.sep) + os.sep):
+            return path[len(root_dir.rstrip(os.sep)) + 1:]
+    return path
+
+
+def get_physical_memory():
+    r"""Returns the size of physical memory in bytes, or None if it can't be detected."""
+
+    import os
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    # macOS doesn't report SC_PHYS_PAGES
+    import subprocess
+    try:
+        return int(subprocess.check_output(["sysctl", "-n", "hw.memsize"]).decode("ascii").strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def get_pool_depth(memory_per_job):
+    r"""Returns the number of parallel jobs which fit into physical memory, but at most the number of processors."""
+
+    import multiprocessing
+    cpu_count = multiprocessing.cpu_count()
+    memory = get_physical_memory()
+    if memory is None:
+        return cpu_count
+    return max(1, min(cpu_count, memory // memory_per_job))
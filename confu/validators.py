@@ -2,11 +2,18 @@ import os
 import six
 
 
+def _is_subpath(path, dir):
+    # Equivalent to checking that os.path.relpath(path, dir) doesn't start with "..", for normalized absolute paths
+    dir = os.path.normpath(dir)
+    return path == dir or path.startswith(dir.rstrip(os.sep) + os.sep)
+
+
 def validate_include_dir(include_dir, root_dir):
-    include_dir = os.path.normpath(include_dir)
+    from confu.utils import is_dir
     if not os.path.isabs(include_dir):
         include_dir = os.path.join(root_dir, include_dir)
-    if not os.path.isdir(include_dir):
+    include_dir = os.path.normpath(include_dir)
+    if not is_dir(include_dir):
         raise ValueError("Include directory {include_dir} does not exist".format(include_dir=include_dir))
 
     return include_dir
@@ -29,10 +36,10 @@ def validate_source_dir(source_dir, root_dir):
     if not isinstance(source_dir, str):
         raise TypeError("Invalid type of source directory: string expected")
 
+    from confu.utils import is_dir
     source_dir = os.path.normpath(source_dir)
     if os.path.isabs(source_dir):
-        rel_source_dir = os.path.relpath(source_dir, root_dir)
-        if rel_source_dir.startswith(".."):
+        if not _is_subpath(source_dir, root_dir):
             raise ValueError("Source directory {source_dir} is outside of root directory {root_dir}"
                 .format(source_dir=source_dir, root_dir=root_dir))
     else:
@@ -40,7 +47,7 @@ def validate_source_dir(source_dir, root_dir):
             raise ValueError("Relative source directory {source_dir} points outside of root directory"
                 .format(source_dir=source_dir))
         source_dir = os.path.join(root_dir, source_dir)
-    if not os.path.isdir(source_dir):
+    if not is_dir(source_dir):
         raise ValueError("Source directory {source_dir} does not exist".format(source_dir=source_dir))
 
     return source_dir
@@ -50,10 +57,10 @@ def validate_source_path(source_path, source_dir):
     if not isinstance(source_path, str):
         raise TypeError("Invalid type of source path: string expected")
 
+    from confu.utils import is_file
     source_path = os.path.normpath(source_path)
     if os.path.isabs(source_path):
-        rel_source_path = os.path.relpath(source_path, source_dir)
-        if rel_source_path.startswith(".."):
+        if not _is_subpath(source_path, source_dir):
             raise ValueError("Source path {source_path} is outside of source directory {source_dir}"
                 .format(source_path=source_path, source_dir=source_dir))
     else:
@@ -62,13 +69,39 @@ def validate_source_path(source_path, source_dir):
                 .format(source_path=source_path))
         source_path = os.path.join(source_dir, source_path)
 
-    if not os.path.isfile(source_path):
+    if not is_file(source_path):
         raise ValueError("Specified source file {source_path} does not exist"
             .format(source_path=source_path))
 
     return source_path
 
 
+def validate_header_path(header_path, search_dirs, root_dir):
+    r"""Resolves a header like an included file: a relative path is looked up in the search directories in order.
+
+    The header must be inside the root directory, where the build directory mirrors its path.
+    """
+
+    if not isinstance(header_path, str):
+        raise TypeError("Invalid type of header path: string expected")
+
+    from confu.utils import is_file
+    search_dirs = [search_dir for i, search_dir in enumerate(search_dirs) if search_dir not in search_dirs[:i]]
+    if os.path.isabs(header_path):
+        candidates = [os.path.normpath(header_path)]
+    else:
+        candidates = [os.path.normpath(os.path.join(search_dir, header_path)) for search_dir in search_dirs]
+    for candidate in candidates:
+        if is_file(candidate):
+            if not _is_subpath(candidate, root_dir):
+                raise ValueError("Header {header_path} is outside of root directory {root_dir}"
+                    .format(header_path=candidate, root_dir=root_dir))
+            return candidate
+
+    raise ValueError("Specified header {header_path} does not exist in {search_dirs}"
+        .format(header_path=header_path, search_dirs=", ".join(search_dirs)))
+
+
 def validate_source_paths(source_paths, source_dir):
     import collections
     if isinstance(source_paths, str):
@@ -145,6 +178,51 @@ def validate_emscripten_memory_size(memory_size):
         raise TypeError("Invalid memory size type: an integer, string, or all expected")
 
 
+def validate_cache_size(size):
+    if isinstance(size, six.integer_types):
+        if size < 0:
+            raise ValueError("Invalid cache size value {size}: a non-negative number expected".format(size=size))
+
+        return size
+    elif isinstance(size, str):
+        import re
+        match = re.match(r"^(\d+)([KMGT]?)$", size.upper())
+        if not match:
+            raise ValueError("Invalid cache size value {size}: "
+                             "an integer expected with an optional T(era), G(iga), M(ega) or K(ilo) suffix "
+                             "(e.g. 10G)".format(size=size))
+
+        number = int(match.group(1))
+        suffix = match.group(2)
+        return number * {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}[suffix]
+    else:
+        raise TypeError("Invalid cache size type: an integer or string expected")
+
+
+compiler_launchers = ["ccache", "sccache"]
+
+
+def validate_compiler_launcher(launcher):
+    if launcher is None or launcher == "none":
+        return None
+    elif not isinstance(launcher, str):
+        raise TypeError("Invalid type of compiler launcher: string expected")
+
+    from confu.utils import find_executable
+    if launcher == "auto":
+        for name in compiler_launchers:
+            path = find_executable(name)
+            if path is not None:
+                return path
+        return None
+
+    path = find_executable(launcher)
+    if path is None:
+        raise ValueError("Compiler launcher {launcher} not found".format(launcher=launcher))
+
+    return path
+
+
 def validate_module_name(name):
     if not isinstance(name, str):
         raise TypeError("Invalid type of module name: string expected")